@@ -0,0 +1,22 @@
+import os
+import time
+
+# the assets are only converted, there is no need for a window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+from src.Media import MediaLoader
+import settings
+
+if __name__ == '__main__':
+    if not settings.ASSET_CACHE:
+        raise Exception("ASSET_CACHE is off in settings.py, the game would not read the cache")
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    started_at = time.perf_counter()
+    media = MediaLoader()
+    media.load_images()
+    media.load_gifs()
+    print(f"asset cache in {media.asset_cache.directory}: {media.asset_cache.misses} built, "
+          f"{media.asset_cache.hits} already up to date, {time.perf_counter() - started_at:.2f}s")
@@ -1,6 +1,7 @@
 from src.Game import Game
 from src.Models import User, Match, MatchRequest
 from src.SocketClient import SocketClient
+from src.Player import Side
 
 from pygame.display import set_caption as set_pygame_window_title
 
@@ -30,8 +31,32 @@ def multiplayer_game():
     set_pygame_window_title(username)
     game.run()
 
+def spectate_game():
+    username = input("type your username:\n")
+    me = User(username=username)
+    socket = SocketClient()
+    socket.register_user(user=me)
+    game = Game(is_multiplayer=True, socket_client=socket)
+    player_username = input("type the username of a player whose match you want to watch:\n")
+    socket.spectate(player_username)
+
+    match = socket.pend_for_match_start()
+    game.left_side_name = match.left_user.username
+    game.right_side_name = match.right_user.username
+    game.pygame_init()
+    game.load_assets()
+    game.board.init_objects()
+    set_pygame_window_title(f"{username} watching {player_username}")
+    game.run()
+
 def monoplayer_game():
-    game = Game()
+    ans = input("are you want to play against the computer? [y/n] ")
+    if ans == "y":
+        game = Game(bot_side=Side.BLUE)
+    elif ans == "n":
+        game = Game()
+    else:
+        raise Exception("Invalid command")
     game.pygame_init()
     game.load_assets()
     game.board.init_objects()
@@ -40,11 +65,13 @@ def monoplayer_game():
 
 
 if __name__ == '__main__':
-    game_type = input("1) Monoplayer(Offline)\n2) Multiplayer(Online)\n:")
+    game_type = input("1) Monoplayer(Offline)\n2) Multiplayer(Online)\n3) Watch a match(Online, asyncio server only)\n:")
     match game_type:
         case "1":
             monoplayer_game()
         case "2":
             multiplayer_game()
+        case "3":
+            spectate_game()
         case _:
             raise Exception("Invalid game type.")
\ No newline at end of file
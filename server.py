@@ -1,4 +1,5 @@
 from server.python_server.SocketServer import run_server as run_python_server
+from server.python_server.ShardedSocketServer import run_server as run_python_sharded_server
 import os
 import subprocess
 import platform
@@ -20,12 +21,14 @@ def run_cpp_server():
     subprocess.run(run_command, capture_output=True, text=True)
 
 if __name__ == '__main__':
-    server_type = input("1) Python Server\n2) C++ server(only for unix-based OSs):\n>>>")
+    server_type = input("1) Python Server\n2) C++ server(only for unix-based OSs)\n3) Python asyncio server(for thousands of players, one worker per cpu core):\n>>>")
 
     match server_type:
         case "1":
             run_python_server()
         case "2":
             run_cpp_server()
+        case "3":
+            run_python_sharded_server(workers=os.cpu_count() or 1)
         case _:
             raise Exception("Invalid server type")
\ No newline at end of file
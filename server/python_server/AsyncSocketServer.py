@@ -0,0 +1,388 @@
+from pydantic import BaseModel
+
+import asyncio
+import logging
+import random
+import struct
+import os
+
+from src.Models import User, Match, MatchRequest, NetworkMode, Shot, Spectate, BoardUpdate, WireFormat
+from src.Protocol import (RELAYED_EVENTS, BoardDeltaDecoder, PackedBoardUpdate, encode_event, decode_event,
+                          event_name_of, peek_event_name)
+from src.Player import Side
+from utils.time import now_time
+from .Matchmaker import Matchmaker
+from .MatchSimulator import MatchSimulator, SimulatedMatch
+import settings
+
+logging.basicConfig(
+    filename = os.path.join('log', 'server', 'server.log'),
+    level=logging.INFO,
+    format = "{asctime} - {levelname} - {message}",
+    style="{",
+    datefmt="%Y-%m-%d %H:%M"
+)
+
+MESSAGE_LENGTH = struct.Struct('!I')
+# what a slow spectator misses of these is made up for by the next ones
+SPECTATOR_DROPPABLE_EVENTS = frozenset({"board_update", "drag_preview"})
+
+
+class ClientConnection(asyncio.Protocol):
+    # one per client socket, frames are cut out of a per-connection buffer instead of being read byte by byte
+
+    def __init__(self, server: 'AsyncSocketServer'):
+        self.server = server
+        self.transport: asyncio.Transport = None
+        self.user: User | None = None
+        self.wire_format = WireFormat.JSON
+        self.buffer = bytearray()
+        self.is_handing_over = False # set while the connection moves to another worker, its frames are kept for it
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+
+    def data_received(self, data: bytes):
+        # frames are handed on as views into the received bytes, which can never change under a pending write
+        if self.buffer:
+            self.buffer += data
+            data = bytes(self.buffer)
+            self.buffer.clear()
+        view = memoryview(data)
+        start = 0
+        while len(view) - start >= MESSAGE_LENGTH.size:
+            message_length, = MESSAGE_LENGTH.unpack_from(view, start)
+            if message_length > settings.SERVER_MAX_MESSAGE_SIZE:
+                logging.error(f"Frame of {message_length} bytes from {self.user=}, closing the connection")
+                self.close()
+                return
+            end = start + MESSAGE_LENGTH.size + message_length
+            if len(view) < end:
+                break
+            if self.is_handing_over:
+                break
+            self.server.handle_frame(self, view[start:end])
+            start = end
+            if self.transport.is_closing():
+                return
+        self.buffer += view[start:]
+
+    def connection_lost(self, exc: Exception | None):
+        self.server.close_connection(self)
+
+    def send_message(self, message: bytes):
+        self.transport.writelines((MESSAGE_LENGTH.pack(len(message)), message))
+
+    def send_frame(self, frame: memoryview):
+        # a frame is already length prefixed
+        self.transport.write(frame)
+
+    def close(self):
+        self.transport.close()
+
+
+class SharedFrame:
+    # one event going out to many connections, encoded at most once per wire format and the same
+    # length prefixed bytes are handed to every transport
+
+    def __init__(self, event_name: str, model: BaseModel | PackedBoardUpdate | None = None,
+                 frame: memoryview | None = None, wire_format: WireFormat | None = None):
+        self.event_name = event_name
+        self.model = model
+        self.frames: dict[WireFormat, bytes | memoryview] = dict()
+        if frame is not None:
+            self.frames[wire_format] = frame
+
+    def get_model(self) -> BaseModel | PackedBoardUpdate:
+        if self.model is None:
+            frame = next(iter(self.frames.values()))
+            self.model = decode_event(frame[MESSAGE_LENGTH.size:])["content"]
+        return self.model
+
+    def frame(self, wire_format: WireFormat) -> bytes | memoryview:
+        if wire_format not in self.frames:
+            message = encode_event(self.get_model(), wire_format)
+            self.frames[wire_format] = MESSAGE_LENGTH.pack(len(message)) + message
+        return self.frames[wire_format]
+
+
+class Spectator:
+
+    def __init__(self, connection: ClientConnection):
+        self.connection = connection
+        # boards are delta encoded, one that missed some can only go on from a full board
+        self.needs_keyframe = True
+        self.frames_dropped = 0
+
+
+class SpectatorGroup:
+    # the watchers of one match, a slow one has frames dropped instead of slowing the players down
+
+    def __init__(self, match: Match):
+        self.match = match
+        self.spectators: dict[ClientConnection, Spectator] = dict()
+        # the board as the spectators' own decoders rebuild it, valid from the first keyframe on
+        self.board_decoder = BoardDeltaDecoder()
+        self.has_board = False
+
+    def __len__(self) -> int:
+        return len(self.spectators)
+
+    def add(self, connection: ClientConnection):
+        self.spectators[connection] = Spectator(connection)
+
+    def remove(self, connection: ClientConnection) -> Spectator | None:
+        return self.spectators.pop(connection, None)
+
+    def decode_board(self, shared: SharedFrame) -> PackedBoardUpdate | None:
+        board = shared.get_model()
+        if isinstance(board, BoardUpdate):
+            board = PackedBoardUpdate.from_board_update(board)
+        if not board.is_keyframe and not self.has_board:
+            return None
+        self.has_board = True
+        return self.board_decoder.decode(board)
+
+    def fan_out(self, shared: SharedFrame):
+        full_board = self.decode_board(shared) if shared.event_name == "board_update" else None
+        keyframe: SharedFrame | None = None
+        for spectator in self.spectators.values():
+            connection = spectator.connection
+            if connection.transport.is_closing():
+                continue
+            buffered = connection.transport.get_write_buffer_size()
+            if shared.event_name in SPECTATOR_DROPPABLE_EVENTS:
+                if buffered > settings.SPECTATOR_WRITE_BUFFER_LIMIT:
+                    spectator.frames_dropped += 1
+                    spectator.needs_keyframe |= shared.event_name == "board_update"
+                    continue
+                if shared.event_name == "board_update" and spectator.needs_keyframe:
+                    if full_board is None:
+                        continue
+                    if keyframe is None:
+                        keyframe = SharedFrame("board_update", full_board)
+                    connection.send_frame(keyframe.frame(connection.wire_format))
+                    spectator.needs_keyframe = False
+                    continue
+            elif buffered > settings.SPECTATOR_MAX_WRITE_BUFFER:
+                logging.info(f"Spectator {connection.user=} too far behind, {spectator.frames_dropped} frames dropped")
+                connection.close()
+                continue
+            connection.send_frame(shared.frame(connection.wire_format))
+
+
+class AsyncSocketServer:
+    HOST_ADDR = ('0.0.0.0', 3022)
+    LISTEN_BACKLOG = 4096
+
+    def __init__(self):
+        self.users_client: dict[int, ClientConnection] = dict()
+        self.usernames_client: dict[str, ClientConnection] = dict()
+        self.client_matches: dict[ClientConnection, Match] = dict()
+        # both players of a watched match point to its group, every spectator to the group it watches
+        self.spectator_groups: dict[ClientConnection, SpectatorGroup] = dict()
+        self.watched_groups: dict[ClientConnection, SpectatorGroup] = dict()
+        self.opponents: dict[ClientConnection, ClientConnection] = dict()
+        self.matchmaker = Matchmaker(is_alive=lambda client: not client.transport.is_closing())
+        self.simulator = MatchSimulator()
+        self.simulated_matches: dict[ClientConnection, SimulatedMatch] = dict()
+
+    def send_event(self, client: ClientConnection, model: BaseModel):
+        client.send_message(encode_event(model, client.wire_format))
+
+    def new_connection(self) -> ClientConnection:
+        return ClientConnection(self)
+
+    def create_server(self, loop: asyncio.AbstractEventLoop):
+        return loop.create_server(self.new_connection, *self.HOST_ADDR, reuse_address=True, backlog=self.LISTEN_BACKLOG)
+
+    def __game_side_lottery(self):
+        sides = [Side.RED, Side.BLUE]
+        rand_index = random.randint(0, 1)
+        return sides[rand_index]
+
+    def start_match(self, client: ClientConnection, opponent_client: ClientConnection, match: Match):
+        logging.info(f"Two users matched: {match=}")
+        self.send_event(client, match)
+        self.send_event(opponent_client, match)
+        self.opponents[client] = opponent_client
+        self.opponents[opponent_client] = client
+        self.client_matches[client] = self.client_matches[opponent_client] = match
+        if match.network_mode() == NetworkMode.AUTHORITATIVE:
+            left_client, right_client = ((client, opponent_client) if client.user.id == match.left_user.id
+                                         else (opponent_client, client))
+            simulated_match = self.simulator.add_match({Side.RED: left_client, Side.BLUE: right_client}, now_time())
+            self.simulated_matches[client] = self.simulated_matches[opponent_client] = simulated_match
+
+    def event_user_registeration(self, client: ClientConnection, user: User):
+        client.user = user
+        client.wire_format = user.wire_format
+        self.users_client[user.id] = client
+        self.usernames_client[user.username] = client
+
+    def event_match_request(self, client: ClientConnection, user: User, match_request_model: MatchRequest):
+        # a spectator keeps getting the frames of the match it watches, it can not play one at the same time
+        if client not in self.opponents and client not in self.watched_groups:
+            self.matchmaker.enqueue(client, user.rating, match_request_model.rtt, now_time())
+
+    def run_matchmaking(self):
+        for opponent_client, client in self.matchmaker.match(now_time()):
+            user, opponent = client.user, opponent_client.user
+            user_side = self.__game_side_lottery()
+            match user_side:
+                case Side.RED:
+                    match = Match(left_user=user, right_user=opponent)
+                case Side.BLUE:
+                    match = Match(left_user=opponent, right_user=user)
+            self.start_match(client, opponent_client, match)
+
+    async def matchmaking_loop(self):
+        while True:
+            await asyncio.sleep(settings.MATCHMAKING_INTERVAL / 1000)
+            self.run_matchmaking()
+
+    def event_spectate(self, client: ClientConnection, user: User, spectate: Spectate):
+        player_client = self.usernames_client.get(spectate.username)
+        match = self.client_matches.get(player_client)
+        if match is None or client in self.client_matches or client in self.watched_groups:
+            logging.info(f"Nothing to spectate for {user=}: {spectate=}")
+            client.close()
+            return
+        group = self.spectator_groups.get(player_client)
+        if group is None:
+            group = SpectatorGroup(match)
+            self.spectator_groups[player_client] = self.spectator_groups[self.opponents[player_client]] = group
+        group.add(client)
+        self.watched_groups[client] = group
+        self.send_event(client, match)
+
+    def fan_out_to_spectators(self, client: ClientConnection, shared: SharedFrame):
+        group = self.spectator_groups.get(client)
+        if group is not None:
+            group.fan_out(shared)
+
+    def event_shot(self, client: ClientConnection, user: User, shot: Shot):
+        simulated_match = self.simulated_matches[client]
+        side = Side.RED if simulated_match.clients[Side.RED] is client else Side.BLUE
+        if not self.simulator.apply_shot(simulated_match, side, shot, now_time()):
+            logging.info(f"Shot of {user=} refused: {shot=}")
+
+    def run_simulation(self):
+        for simulated_match, model in self.simulator.advance(now_time()):
+            self.send_to_match(simulated_match, model)
+
+    def send_to_match(self, simulated_match: SimulatedMatch, model: BaseModel | PackedBoardUpdate):
+        # encoded once per wire format, both players and the spectators of a match get the same bytes
+        shared = SharedFrame(event_name_of(model), model)
+        for client in simulated_match.clients.values():
+            client.send_frame(shared.frame(client.wire_format))
+        self.fan_out_to_spectators(simulated_match.clients[Side.RED], shared)
+
+    async def simulation_loop(self):
+        while True:
+            await asyncio.sleep(settings.SERVER_TICK_INTERVAL / 1000)
+            self.run_simulation()
+
+    def event_relay_to_opponent(self, client: ClientConnection, user: User, model: BaseModel):
+        opponent_client = self.opponents.get(client)
+        if opponent_client is not None:
+            self.send_event(opponent_client, model)
+
+    def is_relayed(self, client: ClientConnection, event_name: str | None) -> bool:
+        if event_name not in RELAYED_EVENTS:
+            return False
+        # in a simulated match only the drag previews go to the opponent, the rest is the server's job
+        return client not in self.simulated_matches or event_name == "drag_preview"
+
+    def relay_frame(self, client: ClientConnection, frame: memoryview) -> bool:
+        # pass-through traffic is forwarded as it came in when both ends speak the same wire format
+        opponent_client = self.opponents.get(client)
+        if opponent_client is None or opponent_client.wire_format != client.wire_format:
+            return False
+        opponent_client.send_frame(frame)
+        return True
+
+    def handle_frame(self, client: ClientConnection, frame: memoryview):
+        message = frame[MESSAGE_LENGTH.size:]
+        event_name = peek_event_name(message)
+        if self.is_relayed(client, event_name):
+            self.fan_out_to_spectators(client, SharedFrame(event_name, frame=frame, wire_format=client.wire_format))
+            if self.relay_frame(client, frame):
+                return
+        self.handle_message(client, message)
+
+    def handle_message(self, client: ClientConnection, message: memoryview):
+        try:
+            event = decode_event(message)
+        except Exception:
+            logging.error(f"Invalid message from {client.user=}, closing the connection")
+            client.close()
+            return
+        event_name, content = event["event"], event["content"]
+
+        if client.user is None:
+            if event_name == "user_registeration":
+                self.event_user_registeration(client, content)
+            else:
+                client.close()
+            return
+
+        match event_name:
+            case "match_request":
+                self.event_match_request(client, client.user, content)
+            case "spectate":
+                self.event_spectate(client, client.user, content)
+            case "shot" if client in self.simulated_matches:
+                self.event_shot(client, client.user, content)
+            case "board_update" | "turn_end" if client in self.simulated_matches:
+                pass # the server's own simulation is the only board of the match
+            case "board_update" | "shot" | "drag_preview" | "turn_end":
+                self.event_relay_to_opponent(client, client.user, content)
+
+    def close_connection(self, client: ClientConnection):
+        self.matchmaker.cancel(client)
+        if client.user is not None and self.users_client.get(client.user.id) is client:
+            del self.users_client[client.user.id]
+        if client.user is not None and self.usernames_client.get(client.user.username) is client:
+            del self.usernames_client[client.user.username]
+        watched_group = self.watched_groups.pop(client, None)
+        if watched_group is not None:
+            watched_group.remove(client)
+        self.client_matches.pop(client, None)
+        group = self.spectator_groups.pop(client, None)
+        if group is not None:
+            # the match is over for its spectators too
+            for spectator_client in list(group.spectators):
+                spectator_client.close()
+        simulated_match = self.simulated_matches.pop(client, None)
+        if simulated_match is not None:
+            for player_client in simulated_match.clients.values():
+                self.simulated_matches.pop(player_client, None)
+            self.simulator.remove_match(simulated_match)
+        opponent_client = self.opponents.pop(client, None)
+        if opponent_client is not None:
+            # like the threaded server, the match ends for both players
+            self.opponents.pop(opponent_client, None)
+            self.spectator_groups.pop(opponent_client, None)
+            opponent_client.close()
+            logging.info(f"A game finished.")
+
+    async def serve(self):
+        server = await self.create_server(asyncio.get_running_loop())
+        print(f"Starting SoccerStar asyncio socket server, listening on {self.HOST_ADDR}")
+        background_tasks = [asyncio.ensure_future(self.matchmaking_loop()),
+                            asyncio.ensure_future(self.simulation_loop())]
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in background_tasks:
+                task.cancel()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+
+def run_async_server():
+    server = AsyncSocketServer()
+    server.run()
@@ -0,0 +1,87 @@
+import socket
+import logging
+import threading
+from collections import deque
+from typing import Callable
+
+from utils.socket import socket_ordered_send_message
+import settings
+
+DROPPABLE_EVENTS = frozenset({"board_update", "drag_preview"})
+
+
+class ClientOutbox:
+    # the messages for one player of an authoritative match, written by a thread of its own, so a slow
+    # player has frames dropped instead of holding the simulator lock for every other match
+
+    def __init__(self, client: socket.socket):
+        self.client = client
+        self.messages: deque[bytes] = deque()
+        self.queued_bytes = 0
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.is_closed = False
+        # boards are delta encoded, one that missed some can only go on from a full board
+        self.needs_keyframe = False
+        self.frames_dropped = 0
+
+    def start(self):
+        threading.Thread(target=self.send_loop, daemon=True).start()
+
+    def put(self, event_name: str, message: bytes, keyframe: Callable[[], bytes] | None = None):
+        # never blocks, the keyframe is only encoded for a player that dropped a board before
+        with self.lock:
+            if self.is_closed:
+                return
+            if event_name in DROPPABLE_EVENTS:
+                if self.queued_bytes > settings.PLAYER_WRITE_BUFFER_LIMIT:
+                    self.frames_dropped += 1
+                    self.needs_keyframe |= event_name == "board_update"
+                    return
+                if event_name == "board_update" and self.needs_keyframe:
+                    if keyframe is None:
+                        return
+                    message = keyframe()
+                    self.needs_keyframe = False
+            elif self.queued_bytes > settings.PLAYER_MAX_WRITE_BUFFER:
+                logging.info(f"Client {self.client=} too far behind, {self.frames_dropped} frames dropped")
+                self.close_locked()
+                # its receiving thread sees the connection end and closes the match
+                try:
+                    self.client.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                return
+            self.messages.append(message)
+            self.queued_bytes += len(message)
+        self.ready.set()
+
+    def close(self):
+        with self.lock:
+            self.close_locked()
+
+    def close_locked(self):
+        self.is_closed = True
+        self.messages.clear()
+        self.queued_bytes = 0
+        self.ready.set()
+
+    def send_loop(self):
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            while True:
+                with self.lock:
+                    if self.is_closed:
+                        return
+                    if not self.messages:
+                        break
+                    message = self.messages.popleft()
+                try:
+                    socket_ordered_send_message(self.client, message)
+                except:
+                    logging.error(f"Error sending message to client{self.client=}")
+                    self.close()
+                    return
+                with self.lock:
+                    self.queued_bytes -= len(message)
@@ -0,0 +1,186 @@
+import numpy as np
+from typing import Hashable
+from pydantic import BaseModel
+
+from src.Models import MouseStatus, Shot, TurnEnd
+from src.Physics import BatchPhysicsEngine
+from src.Player import Side
+from src.Protocol import BoardDeltaEncoder, PackedBoardUpdate
+from src.SendRateController import SendRateController
+from src.Simulation import Simulation, put_players_in_place, scored_side_values
+import settings
+
+SERVER_MOUSE = ((0, 0), MouseStatus.IDLE) # the players draw their own mouse, the server has none
+
+
+class SimulatedMatch:
+    # the rules Game applies to one match, its objects are one board of the simulator's batch
+
+    def __init__(self, clients: dict[Side, Hashable], board: int, now: float):
+        self.clients = clients
+        self.board = board
+        self.turn = Side.RED # Game.FIRST_TURN
+        self.scores: dict[Side, int] = {Side.RED: 0, Side.BLUE: 0}
+        self.scored_side: Side | None = None
+        self.turn_deadline = now + settings.TURN_SECONDS
+        self.frozen_until = 0.0 # end of the running goal or winner ceremony
+        self.is_finished = False
+        self.was_idle = True
+        self.board_encoder = BoardDeltaEncoder()
+        self.send_rate = SendRateController(now)
+
+    def is_frozen(self, now: float) -> bool:
+        return now < self.frozen_until
+
+
+class MatchSimulator:
+    # every authoritative match of the server is a board of one batch engine, so a tick of hundreds of
+    # matches is a few numpy calls over preallocated arrays instead of a physics step per match
+
+    DT = settings.PHYSICS_TIMESTEP
+
+    def __init__(self):
+        self.initial = Simulation.create_initial()
+        self.physics: BatchPhysicsEngine | None = None
+        self.matches: list[SimulatedMatch] = []
+        self.time_accumulator = 0.0
+        self.last_advance_time: float | None = None
+
+    def __len__(self) -> int:
+        return len(self.matches)
+
+    def add_match(self, clients: dict[Side, Hashable], now: float) -> SimulatedMatch:
+        match = SimulatedMatch(clients, len(self.matches), now)
+        if self.physics is None:
+            self.physics = BatchPhysicsEngine(self.initial.physics, 1)
+        else:
+            self.physics.add_boards(self.initial.physics)
+        self.matches.append(match)
+        return match
+
+    def remove_match(self, match: SimulatedMatch):
+        self.matches.remove(match)
+        if not self.matches:
+            self.physics = None
+            return
+        self.physics.keep_boards(np.array([other.board for other in self.matches]))
+        for board, other in enumerate(self.matches):
+            other.board = board
+
+    def board_pos(self, match: SimulatedMatch) -> np.ndarray:
+        return self.physics.per_board(self.physics.pos)[match.board]
+
+    def board_velocity(self, match: SimulatedMatch) -> np.ndarray:
+        return self.physics.per_board(self.physics.velocity)[match.board]
+
+    def dump_board(self, match: SimulatedMatch) -> PackedBoardUpdate:
+        return PackedBoardUpdate.from_arrays(
+            *SERVER_MOUSE, self.initial.physics.ids, self.board_pos(match), self.board_velocity(match)
+        )
+
+    def apply_shot(self, match: SimulatedMatch, side: Side, shot: Shot, now: float) -> bool:
+        # the same checks as Player.is_activated, anything else the client sends is ignored
+        if match.is_finished or match.is_frozen(now) or side != match.turn or self.board_velocity(match).any():
+            return False
+        slot = self.initial.slots.get(shot.object_id)
+        if slot is None or self.initial.sides[slot] != side.value:
+            return False
+        velocity = np.array((shot.velocity.x, shot.velocity.y), dtype=np.float64)
+        speed = np.hypot(*velocity)
+        if not np.isfinite(speed):
+            return False
+        if speed > settings.SERVER_MAX_SHOT_SPEED:
+            velocity *= settings.SERVER_MAX_SHOT_SPEED / speed
+        self.board_velocity(match)[slot] = velocity
+        self.physics.velocity_changed()
+        # even a shot too weak to move anything ends the turn
+        match.was_idle = False
+        return True
+
+    def turn_end(self, match: SimulatedMatch, now: float) -> list[tuple[SimulatedMatch, BaseModel | PackedBoardUpdate]]:
+        board = self.dump_board(match)
+        # the next turn starts from the quantized board the players get, like in lockstep mode
+        pos = self.board_pos(match)
+        pos[:, 0], pos[:, 1] = board.objects["x"], board.objects["y"]
+        match.turn_deadline = now + settings.TURN_SECONDS
+        turn_end = TurnEnd(
+            board=board.to_board_update(),
+            turn=match.turn.value,
+            red_score=match.scores[Side.RED],
+            blue_score=match.scores[Side.BLUE]
+        )
+        # followed by the same board, so it is also the newest one of the players' jitter buffers
+        match.board_encoder.reset()
+        match.send_rate.sent(0.0, SERVER_MOUSE, now)
+        return [(match, turn_end), (match, match.board_encoder.encode(board))]
+
+    def end_of_turn_jobs(self, match: SimulatedMatch, now: float) -> list[tuple[SimulatedMatch, BaseModel | PackedBoardUpdate]]:
+        put_players_in_place(self.board_pos(match), self.physics.per_board(self.physics.radius)[match.board],
+                             self.initial.sides, self.initial.goalkeepers)
+        match.turn = Side.RED if match.turn == Side.BLUE else Side.BLUE
+        return self.turn_end(match, now)
+
+    def scored(self, match: SimulatedMatch, scored_side: Side, now: float) -> list[tuple[SimulatedMatch, BaseModel | PackedBoardUpdate]]:
+        match.scores[scored_side] += 1
+        match.scored_side = scored_side
+        # the side that conceded kicks off, the players see the goal from the raised score
+        match.turn = Side.RED if scored_side == Side.BLUE else Side.BLUE
+        if match.scores[scored_side] == 3:
+            match.is_finished = True
+            match.frozen_until = now + settings.WINNER_CEREMONY_TIME / 1000
+        else:
+            match.frozen_until = now + settings.GOAL_CEREMONY_TIME / 1000
+        return self.turn_end(match, now)
+
+    def goal_ceremony_end(self, match: SimulatedMatch, now: float) -> list[tuple[SimulatedMatch, BaseModel | PackedBoardUpdate]]:
+        # kickoff positions, same as Board.reset_board_state
+        self.board_pos(match)[:] = self.initial.physics.pos
+        self.board_velocity(match)[:] = 0
+        self.physics.velocity_changed()
+        match.scored_side = None
+        match.was_idle = True
+        return self.turn_end(match, now)
+
+    def advance(self, now: float) -> list[tuple[SimulatedMatch, BaseModel | PackedBoardUpdate]]:
+        # steps every match up to now and returns what has to be sent to both players of each
+        if self.last_advance_time is not None:
+            self.time_accumulator += now - self.last_advance_time
+        self.last_advance_time = now
+        if self.physics is None:
+            self.time_accumulator = 0.0
+            return []
+
+        steps = 0
+        while self.time_accumulator >= self.DT and steps < settings.MAX_PHYSICS_STEPS_PER_FRAME:
+            self.physics.step(self.DT)
+            self.time_accumulator -= self.DT
+            steps += 1
+        if steps == settings.MAX_PHYSICS_STEPS_PER_FRAME:
+            self.time_accumulator = min(self.time_accumulator, self.DT)
+
+        # goals, idleness and speed of every board at once, like the client checks them once per frame
+        ball_slots = self.physics.slots(self.initial.ball_slot)
+        scored_sides = scored_side_values(self.physics.pos[ball_slots], self.physics.radius[ball_slots]).tolist()
+        speeds = self.physics.per_board(np.hypot(self.physics.velocity[:, 0], self.physics.velocity[:, 1]))
+        speeds = speeds.max(axis=1).tolist()
+
+        messages = []
+        for match, scored_side, speed in zip(self.matches, scored_sides, speeds):
+            if match.is_finished:
+                continue
+            is_idle = speed == 0
+            if match.is_frozen(now):
+                pass
+            elif match.scored_side is not None:
+                messages += self.goal_ceremony_end(match, now)
+                continue
+            elif scored_side:
+                messages += self.scored(match, Side(scored_side), now)
+                continue
+            elif is_idle and (not match.was_idle or now >= match.turn_deadline):
+                messages += self.end_of_turn_jobs(match, now)
+            match.was_idle = is_idle
+
+            if match.send_rate.should_send_motion(speed, SERVER_MOUSE, now):
+                messages.append((match, match.board_encoder.encode(self.dump_board(match))))
+        return messages
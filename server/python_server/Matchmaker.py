@@ -0,0 +1,117 @@
+import bisect
+from collections import deque
+from typing import Callable, Hashable
+
+import settings
+
+
+class MatchmakingTicket:
+
+    def __init__(self, key: Hashable, rating: int, rtt: float | None, bucket: tuple[int, int], enqueued_at: float):
+        self.key = key
+        self.rating = rating
+        self.rtt = rtt
+        self.bucket = bucket
+        self.enqueued_at = enqueued_at
+        self.is_waiting = True
+
+
+class Matchmaker:
+    # waiting players are queued per (rating, rtt) bucket and paired in periodic batches, a cancelled
+    # ticket is only flagged and skipped when its queue reaches it, so every operation stays O(1)
+
+    def __init__(self, is_alive: Callable[[Hashable], bool] = lambda key: True):
+        self.is_alive = is_alive
+        self.tickets: dict[Hashable, MatchmakingTicket] = dict()
+        self.buckets: dict[tuple[int, int], deque[MatchmakingTicket]] = dict()
+        self.waiting_in_bucket: dict[tuple[int, int], int] = dict()
+
+    def __len__(self) -> int:
+        return len(self.tickets)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.tickets
+
+    def bucket_of(self, rating: int, rtt: float | None) -> tuple[int, int]:
+        # a client that did not report its rtt is taken for a close one
+        rtt_bucket = bisect.bisect_left(settings.MATCHMAKING_RTT_BUCKETS, rtt) if rtt is not None else 0
+        return rating // settings.MATCHMAKING_RATING_BUCKET_WIDTH, rtt_bucket
+
+    def enqueue(self, key: Hashable, rating: int, rtt: float | None, now: float) -> bool:
+        if key in self.tickets:
+            return False
+        ticket = MatchmakingTicket(key, rating, rtt, self.bucket_of(rating, rtt), now)
+        self.tickets[key] = ticket
+        self.buckets.setdefault(ticket.bucket, deque()).append(ticket)
+        self.waiting_in_bucket[ticket.bucket] = self.waiting_in_bucket.get(ticket.bucket, 0) + 1
+        return True
+
+    def cancel(self, key: Hashable) -> bool:
+        ticket = self.tickets.pop(key, None)
+        if ticket is None:
+            return False
+        ticket.is_waiting = False
+        self.waiting_in_bucket[ticket.bucket] -= 1
+        queue = self.buckets[ticket.bucket]
+        if len(queue) > 2 * self.waiting_in_bucket[ticket.bucket] + settings.MATCHMAKING_COMPACT_SLACK:
+            # mostly cancelled tickets, rebuilt so a queue that rarely pairs does not grow with churn
+            self.buckets[ticket.bucket] = deque(ticket for ticket in queue if ticket.is_waiting)
+        return True
+
+    def remove(self, ticket: MatchmakingTicket):
+        del self.tickets[ticket.key]
+        ticket.is_waiting = False
+        self.waiting_in_bucket[ticket.bucket] -= 1
+
+    def take(self, queue: deque[MatchmakingTicket]) -> MatchmakingTicket | None:
+        # the oldest ticket of the queue whose player is still connected
+        while queue:
+            ticket = queue.popleft()
+            if not ticket.is_waiting:
+                continue
+            if not self.is_alive(ticket.key):
+                self.remove(ticket)
+                continue
+            return ticket
+        return None
+
+    def can_pair(self, ticket: MatchmakingTicket, other: MatchmakingTicket, now: float) -> bool:
+        # the longer both have waited, the further apart their buckets may be
+        waited = now - max(ticket.enqueued_at, other.enqueued_at)
+        reach = int(waited // settings.MATCHMAKING_WIDEN_INTERVAL)
+        return (abs(ticket.bucket[0] - other.bucket[0]) <= reach and
+                abs(ticket.bucket[1] - other.bucket[1]) <= reach)
+
+    def match(self, now: float) -> list[tuple[Hashable, Hashable]]:
+        # pairs of keys, the one that has waited longer first
+        pairs = []
+        leftovers: list[MatchmakingTicket] = []
+        for queue in self.buckets.values():
+            while (ticket := self.take(queue)) is not None:
+                other = self.take(queue)
+                if other is None:
+                    leftovers.append(ticket)
+                    break
+                self.remove(ticket)
+                self.remove(other)
+                pairs.append((ticket.key, other.key))
+
+        # at most one player per bucket is left, neighbours in rating and rtt may take each other
+        leftovers.sort(key=lambda ticket: ticket.bucket)
+        index = 0
+        while index < len(leftovers) - 1:
+            ticket, other = leftovers[index], leftovers[index + 1]
+            if self.can_pair(ticket, other, now):
+                if other.enqueued_at < ticket.enqueued_at:
+                    ticket, other = other, ticket
+                self.remove(ticket)
+                self.remove(other)
+                pairs.append((ticket.key, other.key))
+                index += 2
+            else:
+                index += 1
+
+        for ticket in leftovers:
+            if ticket.is_waiting:
+                self.buckets[ticket.bucket].appendleft(ticket)
+        return pairs
@@ -0,0 +1,373 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import select
+import socket
+import time
+from collections import deque
+
+from src.Models import User, Match, MatchRequest, Spectate
+from utils.time import now_time
+from .AsyncSocketServer import AsyncSocketServer, ClientConnection
+from .Matchmaker import Matchmaker
+import settings
+
+CONTROL_MESSAGE_MAX_SIZE = 1 << 16
+
+
+def send_control(control: socket.socket, message: dict, fd: int | None = None):
+    # control sockets are SOCK_SEQPACKET, so every message arrives whole and carries its fd with it
+    data = json.dumps(message).encode('utf-8')
+    socket.send_fds(control, [data], [fd] if fd is not None else [])
+
+
+def recv_control(control: socket.socket) -> tuple[dict, int | None] | None:
+    data, fds, _, _ = socket.recv_fds(control, CONTROL_MESSAGE_MAX_SIZE, 1)
+    if not data:
+        return None
+    return json.loads(data), (fds[0] if fds else None)
+
+
+class ShardWorker(AsyncSocketServer):
+    # one of the processes sharing the listening port, relays every match whose both players it holds
+
+    def __init__(self, index: int, control: socket.socket):
+        super().__init__()
+        self.index = index
+        self.control = control
+        self.connections: dict[int, ClientConnection] = dict()
+        self.waiting_for_match: set[ClientConnection] = set()
+        self.match_requests: dict[ClientConnection, MatchRequest] = dict()
+        self.last_connection_id = 0
+        self.serving: asyncio.Future | None = None
+        # messages the coordinator could not take yet, a blocking send could deadlock with its own sends to us
+        self.control_outbox: deque[tuple[dict, int | None]] = deque()
+        self.is_flushing_control = False
+
+    def send_control(self, message: dict, fd: int | None = None):
+        # the fd is closed here once it went out
+        self.control_outbox.append((message, fd))
+        if not self.is_flushing_control:
+            self.flush_control()
+
+    def flush_control(self):
+        while self.control_outbox:
+            message, fd = self.control_outbox[0]
+            try:
+                send_control(self.control, message, fd)
+            except BlockingIOError:
+                if not self.is_flushing_control:
+                    self.is_flushing_control = True
+                    asyncio.get_running_loop().add_writer(self.control, self.flush_control)
+                return
+            self.control_outbox.popleft()
+            if fd is not None:
+                os.close(fd)
+        if self.is_flushing_control:
+            self.is_flushing_control = False
+            asyncio.get_running_loop().remove_writer(self.control)
+
+    def new_connection(self) -> ClientConnection:
+        client = ClientConnection(self)
+        self.last_connection_id += 1
+        client.connection_id = self.last_connection_id
+        self.connections[client.connection_id] = client
+        return client
+
+    def create_server(self, loop: asyncio.AbstractEventLoop):
+        return loop.create_server(
+            self.new_connection, *self.HOST_ADDR, reuse_address=True, reuse_port=True, backlog=self.LISTEN_BACKLOG
+        )
+
+    def event_match_request(self, client: ClientConnection, user: User, match_request_model: MatchRequest):
+        if client in self.opponents or client in self.watched_groups or client in self.waiting_for_match:
+            return
+        self.waiting_for_match.add(client)
+        self.match_requests[client] = match_request_model
+        self.send_control({
+            "event": "match_request", "connection_id": client.connection_id, "user": user.model_dump(mode="json"),
+            "rtt": match_request_model.rtt
+        })
+
+    def start_match(self, client: ClientConnection, opponent_client: ClientConnection, match: Match):
+        super().start_match(client, opponent_client, match)
+        # so the coordinator can send the spectators of this match here
+        self.send_control({
+            "event": "match_started", "connection_id": client.connection_id,
+            "usernames": [client.user.username, opponent_client.user.username]
+        })
+
+    def event_spectate(self, client: ClientConnection, user: User, spectate: Spectate):
+        if (spectate.username in self.usernames_client or client in self.opponents
+                or client in self.watched_groups or client in self.waiting_for_match):
+            super().event_spectate(client, user, spectate)
+            return
+        # the match is on another worker, if on any, the coordinator hands the spectator over to it, the
+        # frames that came after this one are left unhandled in its buffer and go along with it
+        client.is_handing_over = True
+        client.transport.pause_reading()
+        asyncio.get_running_loop().call_soon(self.send_spectator_away, client, spectate)
+
+    def send_spectator_away(self, client: ClientConnection, spectate: Spectate):
+        if client.transport.is_closing():
+            return
+        connection_id = client.connection_id
+        fd = self.hand_over(client)
+        self.send_control({
+            "event": "spectate", "connection_id": connection_id, "user": client.user.model_dump(mode="json"),
+            "username": spectate.username, "unread": client.buffer.hex(),
+        }, fd)
+
+    def close_connection(self, client: ClientConnection):
+        if self.connections.get(client.connection_id) is not client:
+            # handed over to another worker, the socket itself lives on over there
+            return
+        del self.connections[client.connection_id]
+        self.match_requests.pop(client, None)
+        if client in self.waiting_for_match:
+            self.waiting_for_match.remove(client)
+            self.send_control({"event": "cancel", "connection_id": client.connection_id})
+        opponent_client = self.opponents.get(client)
+        if opponent_client is not None:
+            self.send_control({
+                "event": "match_finished", "connection_id": client.connection_id,
+                "usernames": [client.user.username, opponent_client.user.username]
+            })
+        super().close_connection(client)
+
+    def hand_over(self, client: ClientConnection) -> int:
+        # the connection is forgotten here, a copy of its fd goes to the coordinator
+        fd = os.dup(client.transport.get_extra_info('socket').fileno())
+        del self.connections[client.connection_id]
+        if self.users_client.get(client.user.id) is client:
+            del self.users_client[client.user.id]
+        if self.usernames_client.get(client.user.username) is client:
+            del self.usernames_client[client.user.username]
+        client.transport.abort()
+        return fd
+
+    def take_waiting_client(self, connection_id: int) -> ClientConnection | None:
+        client = self.connections.get(connection_id)
+        if client is None or client not in self.waiting_for_match:
+            return None
+        self.waiting_for_match.remove(client)
+        return client
+
+    def control_match(self, message: dict):
+        client = self.take_waiting_client(message["connection_id"])
+        opponent_client = self.take_waiting_client(message["opponent_connection_id"])
+        if client is None or opponent_client is None:
+            # one of them left meanwhile, the other one goes back to the queue
+            for remaining in (client, opponent_client):
+                if remaining is not None:
+                    self.event_match_request(remaining, remaining.user, self.match_requests[remaining])
+            return
+        self.start_match(client, opponent_client, Match(**message["match"]))
+
+    def control_migrate(self, message: dict):
+        client = self.take_waiting_client(message["connection_id"])
+        if client is None:
+            self.send_control({"event": "gone", "connection_id": message["connection_id"]})
+            return
+        match_request = self.match_requests.pop(client)
+        fd = self.hand_over(client)
+        self.send_control({
+            "event": "migrated",
+            "connection_id": message["connection_id"],
+            "user": client.user.model_dump(mode="json"),
+            "rtt": match_request.rtt,
+            "unread": client.buffer.hex(),
+        }, fd)
+
+    async def control_adopt(self, message: dict, fd: int):
+        loop = asyncio.get_running_loop()
+        _, client = await loop.connect_accepted_socket(self.new_connection, socket.socket(fileno=fd))
+        self.event_user_registeration(client, User(**message["user"]))
+        client.buffer += bytes.fromhex(message["unread"])
+        self.waiting_for_match.add(client)
+        opponent_client = self.take_waiting_client(message["opponent_connection_id"])
+        if opponent_client is None:
+            self.waiting_for_match.remove(client)
+            self.event_match_request(client, client.user, MatchRequest(rtt=message["rtt"]))
+        else:
+            self.start_match(client, opponent_client, Match(**message["match"]))
+        if client.buffer:
+            # frames that were already read on the old worker
+            client.data_received(b'')
+
+    async def control_adopt_spectator(self, message: dict, fd: int):
+        loop = asyncio.get_running_loop()
+        _, client = await loop.connect_accepted_socket(self.new_connection, socket.socket(fileno=fd))
+        self.event_user_registeration(client, User(**message["user"]))
+        client.buffer += bytes.fromhex(message["unread"])
+        # not asked of the coordinator again, a match that ended meanwhile just closes the spectator
+        AsyncSocketServer.event_spectate(self, client, client.user, Spectate(username=message["username"]))
+        if client.buffer and not client.transport.is_closing():
+            # frames that were already read on the old worker
+            client.data_received(b'')
+
+    def control_received(self):
+        received = recv_control(self.control)
+        if received is None:
+            # the coordinator is gone, nobody can be matched anymore
+            self.serving.cancel()
+            return
+        message, fd = received
+        match message["event"]:
+            case "match":
+                self.control_match(message)
+            case "migrate":
+                self.control_migrate(message)
+            case "adopt":
+                asyncio.ensure_future(self.control_adopt(message, fd))
+            case "adopt_spectator":
+                asyncio.ensure_future(self.control_adopt_spectator(message, fd))
+
+    async def serve(self):
+        self.control.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.control, self.control_received)
+        self.serving = asyncio.ensure_future(super().serve())
+        try:
+            await self.serving
+        except asyncio.CancelledError:
+            logging.info(f"Worker {self.index} stopped")
+
+
+class MatchmakingCoordinator:
+    # owns the single matchmaker, a matched pair is moved to one worker before the match starts and the
+    # spectators of a match are sent to the worker it runs on
+
+    def __init__(self, controls: list[socket.socket]):
+        self.controls = controls
+        self.matchmaker = Matchmaker()
+        self.waiting_requests: dict[tuple[int, int], dict] = dict()
+        self.pending_migrations: dict[tuple[int, int], tuple[tuple[int, int], dict, dict]] = dict()
+        self.player_workers: dict[str, int] = dict() # username of every player in a match, to its worker
+
+    def event_match_request(self, key: tuple[int, int], request: dict):
+        self.waiting_requests[key] = request
+        self.matchmaker.enqueue(key, request["user"]["rating"], request["rtt"], now_time())
+
+    def start_match(self, key: tuple[int, int], opponent_key: tuple[int, int]):
+        request, opponent_request = self.waiting_requests.pop(key), self.waiting_requests.pop(opponent_key)
+        users = [User(**request["user"]), User(**opponent_request["user"])]
+        random.shuffle(users)
+        match = Match(left_user=users[0], right_user=users[1]).model_dump(mode="json")
+
+        worker, connection_id = key
+        opponent_worker, opponent_connection_id = opponent_key
+        if worker == opponent_worker:
+            send_control(self.controls[worker], {
+                "event": "match", "connection_id": connection_id,
+                "opponent_connection_id": opponent_connection_id, "match": match
+            })
+        else:
+            # the newcomer moves to the worker of the one who has been waiting
+            self.pending_migrations[key] = (opponent_key, opponent_request, match)
+            send_control(self.controls[worker], {"event": "migrate", "connection_id": connection_id})
+
+    def run_matchmaking(self):
+        for opponent_key, key in self.matchmaker.match(now_time()):
+            self.start_match(key, opponent_key)
+
+    def event_cancel(self, key: tuple[int, int]):
+        self.waiting_requests.pop(key, None)
+        self.matchmaker.cancel(key)
+
+    def event_migrated(self, key: tuple[int, int], message: dict, fd: int):
+        (opponent_worker, opponent_connection_id), _, match = self.pending_migrations.pop(key)
+        send_control(self.controls[opponent_worker], {
+            "event": "adopt", "user": message["user"], "rtt": message["rtt"], "unread": message["unread"],
+            "opponent_connection_id": opponent_connection_id, "match": match
+        }, fd)
+        os.close(fd)
+
+    def event_gone(self, key: tuple[int, int]):
+        # the newcomer left before it could be moved, the opponent is still waiting on its own worker
+        opponent_key, opponent_request, _ = self.pending_migrations.pop(key)
+        self.event_match_request(opponent_key, opponent_request)
+
+    def event_match_started(self, worker: int, message: dict):
+        for username in message["usernames"]:
+            self.player_workers[username] = worker
+
+    def event_match_finished(self, worker: int, message: dict):
+        for username in message["usernames"]:
+            if self.player_workers.get(username) == worker:
+                del self.player_workers[username]
+
+    def event_spectate(self, message: dict, fd: int):
+        worker = self.player_workers.get(message["username"])
+        if worker is not None:
+            send_control(self.controls[worker], {
+                "event": "adopt_spectator", "user": message["user"], "username": message["username"],
+                "unread": message["unread"]
+            }, fd)
+        # without a worker the match is over, closing the only fd left ends the spectator's connection
+        os.close(fd)
+
+    def run(self):
+        interval = settings.MATCHMAKING_INTERVAL / 1000
+        next_matching = time.monotonic() + interval
+        while self.controls:
+            readable, _, _ = select.select(self.controls, [], [], max(next_matching - time.monotonic(), 0))
+            for control in readable:
+                worker = self.controls.index(control)
+                received = recv_control(control)
+                if received is None:
+                    logging.error(f"Worker {worker} exited")
+                    return
+                message, fd = received
+                key = (worker, message["connection_id"])
+                match message["event"]:
+                    case "match_request":
+                        self.event_match_request(key, message)
+                    case "cancel":
+                        self.event_cancel(key)
+                    case "migrated":
+                        self.event_migrated(key, message, fd)
+                    case "gone":
+                        self.event_gone(key)
+                    case "match_started":
+                        self.event_match_started(worker, message)
+                    case "match_finished":
+                        self.event_match_finished(worker, message)
+                    case "spectate":
+                        self.event_spectate(message, fd)
+            if time.monotonic() >= next_matching:
+                self.run_matchmaking()
+                next_matching = time.monotonic() + interval
+
+
+def run_worker(index: int, control: socket.socket, coordinator_controls: list[socket.socket]):
+    # the forked copies of the coordinator's ends would keep the worker alive after the coordinator is gone
+    for coordinator_control in coordinator_controls:
+        coordinator_control.close()
+    ShardWorker(index, control).run()
+
+
+def run_server(workers: int = os.cpu_count() or 1):
+    if workers <= 1:
+        AsyncSocketServer().run()
+        return
+
+    controls, processes = [], []
+    for index in range(workers):
+        coordinator_side, worker_side = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        process = multiprocessing.Process(
+            target=run_worker, args=(index, worker_side, controls + [coordinator_side]), daemon=True
+        )
+        process.start()
+        worker_side.close()
+        controls.append(coordinator_side)
+        processes.append(process)
+
+    print(f"Starting SoccerStar sharded socket server, {workers} workers listening on {AsyncSocketServer.HOST_ADDR}")
+    try:
+        MatchmakingCoordinator(controls).run()
+    finally:
+        for process in processes:
+            process.terminate()
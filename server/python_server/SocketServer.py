@@ -4,12 +4,18 @@ import socket
 import logging
 import random
 import select
+import time
 import _thread
 
-from src.Models import User, Match, MatchRequest, MouseModel, ObjectModel, BoardUpdate, dump_event, load_event
+from src.Models import User, Match, MatchRequest, MouseModel, ObjectModel, BoardUpdate, NetworkMode, Shot, WireFormat
+from src.Protocol import RELAYED_EVENTS, PackedBoardUpdate, encode_event, decode_event, event_name_of, peek_event_name
 from src.Player import Side
-from utils.socket import socket_ordered_recv_message, socket_ordered_send_message
+from utils.socket import SocketReceiveBuffer, socket_is_alive, socket_ordered_send_message
 from utils.time import now_time
+from .ClientOutbox import ClientOutbox
+from .Matchmaker import Matchmaker
+from .MatchSimulator import MatchSimulator, SimulatedMatch
+import settings
 import os
 
 logging.basicConfig(
@@ -30,86 +36,209 @@ class SocketServer:
         self.client_users: dict[socket.socket, User] = dict()
         self.users_client: dict[int, socket.socket] = dict()
         self.opponents: dict[socket.socket, socket.socket] = dict()
-        self.match_request_queue: list[socket.socket] = []
+        self.client_wire_formats: dict[socket.socket, WireFormat] = dict()
+        self.client_receive_buffers: dict[socket.socket, SocketReceiveBuffer] = dict()
+        self.matchmaker = Matchmaker(is_alive=socket_is_alive)
+        self.matchmaker_lock = _thread.allocate_lock()
+        self.simulator = MatchSimulator()
+        self.simulated_matches: dict[socket.socket, SimulatedMatch] = dict()
+        self.simulator_lock = _thread.allocate_lock()
+        self.outboxes: dict[socket.socket, ClientOutbox] = dict() # players of the simulated matches
         self.socket.bind(SocketServer.HOST_ADDR)
         self.socket.listen(5)
         print(f"Starting SoccerStar socket server, listening on {self.HOST_ADDR}")
 
 
     def send_event(self, client: socket.socket, model: BaseModel):
-        message = dump_event(model)
+        message = encode_event(model, self.client_wire_formats.get(client, WireFormat.JSON))
+        outbox = self.outboxes.get(client)
+        if outbox is not None:
+            outbox.put(event_name_of(model), message)
+            return
         try:
             socket_ordered_send_message(client, message)
         except:
             logging.error(f"Error sending message to client{client=}, {message=}")
 
 
-    def get_event(self, client: socket.socket):
+    def get_message(self, client: socket.socket) -> memoryview | None:
         try:
-            message = socket_ordered_recv_message(client)
+            return self.client_receive_buffers[client].recv_message()
         except:
             return None
+
+    def get_event(self, client: socket.socket):
+        message = self.get_message(client)
         if message is None:
             return None
 
-        return load_event(message)
+        return decode_event(message)
+
+    def relay_raw_message(self, client: socket.socket, message: memoryview) -> bool:
+        # pass-through traffic is forwarded as it came in when both ends speak the same wire format
+        opponent_client = self.opponents.get(client)
+        if opponent_client is None or self.client_wire_formats[opponent_client] != self.client_wire_formats[client]:
+            return False
+        event_name = peek_event_name(message)
+        if event_name not in RELAYED_EVENTS or (client in self.simulated_matches and event_name != "drag_preview"):
+            # in a simulated match only the drag previews go to the opponent, the rest is the server's job
+            return False
+        outbox = self.outboxes.get(opponent_client)
+        if outbox is not None:
+            outbox.put(event_name, bytes(message))
+            return True
+        try:
+            socket_ordered_send_message(opponent_client, message)
+        except:
+            logging.error(f"Error relaying message to client{opponent_client=}")
+        return True
     
     def __game_side_lottery(self):
         sides = [Side.RED, Side.BLUE]
         rand_index = random.randint(0, 1)
         return sides[rand_index]        
     
+    def start_match(self, client: socket.socket, opponent_client: socket.socket):
+        user, opponent = self.client_users[client], self.client_users[opponent_client]
+        user_side = self.__game_side_lottery()
+        match user_side:
+            case Side.RED:
+                match = Match(left_user=user, right_user=opponent)
+            case Side.BLUE:
+                match = Match(left_user=opponent, right_user=user)
+
+        logging.info(f"Two users matched: {match=}")
+        self.opponents[client] = opponent_client
+        self.opponents[opponent_client] = client
+        if match.network_mode() == NetworkMode.AUTHORITATIVE:
+            left_client, right_client = ((client, opponent_client) if user.id == match.left_user.id
+                                         else (opponent_client, client))
+            # the match event goes through the outboxes too, so no board of the simulation can overtake it
+            for player_client in (client, opponent_client):
+                self.outboxes[player_client] = ClientOutbox(player_client)
+                self.outboxes[player_client].start()
+            with self.simulator_lock:
+                simulated_match = self.simulator.add_match({Side.RED: left_client, Side.BLUE: right_client}, now_time())
+                self.simulated_matches[client] = self.simulated_matches[opponent_client] = simulated_match
+        self.send_event(client, match)
+        self.send_event(opponent_client, match)
+
     def event_match_request(self, client: socket.socket, user: User, match_request_model: MatchRequest):
-        if self.match_request_queue:
-            opponent_client = self.match_request_queue.pop(0)
-            opponent = self.client_users[opponent_client]
-            user_side = self.__game_side_lottery()
-            match user_side:
-                case Side.RED:
-                    match = Match(left_user=user, right_user=opponent)
-                case Side.BLUE:
-                    match = Match(left_user=opponent, right_user=user)
-
-            logging.info(f"Two users matched: {match=}")            
-            self.send_event(client, match)
-            self.send_event(opponent_client, match)
-            self.opponents[client] = opponent_client
-            self.opponents[opponent_client] = client
-        
-        else:
-            self.match_request_queue.append(client)
-            logging.info("The match request queue is empty")
+        with self.matchmaker_lock:
+            if client not in self.opponents:
+                self.matchmaker.enqueue(client, user.rating, match_request_model.rtt, now_time())
 
-    def event_board_update(self, client: socket.socket, user: User, board_update_model: BoardUpdate):
+    def matchmaking_run(self):
+        while True:
+            time.sleep(settings.MATCHMAKING_INTERVAL / 1000)
+            with self.matchmaker_lock:
+                for opponent_client, client in self.matchmaker.match(now_time()):
+                    self.start_match(client, opponent_client)
+
+    def event_board_update(self, client: socket.socket, user: User, board_update_model: BoardUpdate | PackedBoardUpdate):
         opponent_client = self.opponents[client]
         self.send_event(opponent_client, board_update_model)
 
+    def event_shot(self, client: socket.socket, user: User, shot: Shot):
+        with self.simulator_lock:
+            simulated_match = self.simulated_matches.get(client)
+            if simulated_match is None:
+                return
+            side = Side.RED if simulated_match.clients[Side.RED] is client else Side.BLUE
+            if not self.simulator.apply_shot(simulated_match, side, shot, now_time()):
+                logging.info(f"Shot of {user=} refused: {shot=}")
+
+    def simulation_run(self):
+        while True:
+            time.sleep(settings.SERVER_TICK_INTERVAL / 1000)
+            # only queued under the lock, every player's outbox writes its messages whole and in order
+            with self.simulator_lock:
+                for simulated_match, model in self.simulator.advance(now_time()):
+                    self.send_to_match(simulated_match, model)
+
+    def send_to_match(self, simulated_match: SimulatedMatch, model: BaseModel | PackedBoardUpdate):
+        # encoded once per wire format, both players of a match get the same bytes
+        event_name = event_name_of(model)
+        messages: dict[WireFormat, bytes] = dict()
+        keyframes: dict[WireFormat, bytes] = dict()
+
+        def keyframe(wire_format: WireFormat) -> bytes:
+            # right after encoding, the encoder's baseline is the whole board the players' decoders hold
+            if wire_format not in keyframes:
+                board = PackedBoardUpdate(model.mouse_pos, model.mouse_status,
+                                          simulated_match.board_encoder.baseline.copy(), is_keyframe=True)
+                keyframes[wire_format] = encode_event(board, wire_format)
+            return keyframes[wire_format]
+
+        for client in simulated_match.clients.values():
+            outbox = self.outboxes.get(client)
+            if outbox is None:
+                continue
+            wire_format = self.client_wire_formats.get(client, WireFormat.JSON)
+            if wire_format not in messages:
+                messages[wire_format] = encode_event(model, wire_format)
+            outbox.put(event_name, messages[wire_format],
+                       (lambda: keyframe(wire_format)) if event_name == "board_update" else None)
+
+    def event_relay_to_opponent(self, client: socket.socket, user: User, model: BaseModel):
+        opponent_client = self.opponents[client]
+        self.send_event(opponent_client, model)
+
     def close_connection(self, client):
+        with self.matchmaker_lock:
+            self.matchmaker.cancel(client)
+        with self.simulator_lock:
+            simulated_match = self.simulated_matches.pop(client, None)
+            if simulated_match is not None:
+                for player_client in simulated_match.clients.values():
+                    self.simulated_matches.pop(player_client, None)
+                self.simulator.remove_match(simulated_match)
+        for player_client in (client, self.opponents.get(client)):
+            outbox = self.outboxes.pop(player_client, None)
+            if outbox is not None:
+                outbox.close()
         if client in self.opponents.keys():
             opponent_client = self.opponents[client]
             opponent_client.close()
         client.close()
+        self.client_receive_buffers.pop(client, None)
         logging.info(f"A game finished.")
 
         exit()
 
     def client_run(self, client: socket.socket, user):
         while True:
-            response = self.get_event(client)
-            if response is None:
+            message = self.get_message(client)
+            if message is None:
                 self.close_connection(client)
                 break
+            if self.relay_raw_message(client, message):
+                continue
+            response = decode_event(message)
             event_name, content = response["event"], response["content"]
             match event_name:
+                case "shot" if client in self.simulated_matches:
+                    self.event_shot(client, user, content)
+                case "board_update" | "turn_end" if client in self.simulated_matches:
+                    pass # the server's own simulation is the only board of the match
                 case "board_update":
                     self.event_board_update(client, user, content)
                 case "match_request":
                     self.event_match_request(client, user, content)
+                case "spectate":
+                    # only the asyncio servers keep spectators, closing tells the client there is nothing to watch
+                    logging.info(f"Spectating is not supported by this server, closing {user=}")
+                    self.close_connection(client)
+                case "shot" | "drag_preview" | "turn_end":
+                    self.event_relay_to_opponent(client, user, content)
 
 
     def run(self):
+        _thread.start_new_thread(self.matchmaking_run, ())
+        _thread.start_new_thread(self.simulation_run, ())
         while True:
             client, addr = self.socket.accept()
+            self.client_receive_buffers[client] = SocketReceiveBuffer(client)
 
             new_user = self.get_event(client)
 
@@ -117,6 +246,7 @@ class SocketServer:
 
             self.users_client[user.id] = client
             self.client_users[client] = user
+            self.client_wire_formats[client] = user.wire_format
             
             _thread.start_new_thread(self.client_run, (client, user))
 
@@ -58,14 +58,71 @@ SCOREBAR_PLACE_BLUE_NAME = (885, 110)
 
 TIMER_COORDINATES = (640, 45)
 
+##############################
+# Network constants
+##############################
+
+WIRE_FORMAT = "binary" # requested from the server, used once match_start confirms it, the c++ server keeps us on json
+NETWORK_MODE = "stream" # "lockstep" only exchanges shots, "authoritative" lets the python servers simulate, both players must ask for it
+DRAG_PREVIEW_SEND_INTERVAL = 100 # ms between two drag preview samples sent in lockstep mode
+OUTBOUND_EVENT_QUEUE_SIZE = 256 # events waiting for the network thread, beyond it drag previews are dropped, boards are coalesced and never queue up
+BOARD_KEYFRAME_INTERVAL = 60 # board updates between two full boards, the ones in between only carry changed objects
+BOARD_SEND_INTERVAL_RANGE = (33, 100) # ms between two board updates, from the fastest to the slowest motion
+BOARD_SEND_FAST_SPEED = 600 # pixels per second, from this speed on boards are sent at the shortest interval
+BOARD_HEARTBEAT_INTERVAL = 1000 # ms between two boards while nothing moves, clicks are always sent right away
+BOARD_SEND_MAX_BACKOFF = 8 # the send interval is doubled up to this factor while the socket can not keep up
+BOARD_SEND_BACKOFF_RECOVERY = 0.9 # applied to the backoff factor on every board that went out in time
+SNAPSHOT_INTERPOLATION_DELAY = 120 # ms the opponent's board is drawn behind real time, the slowest send interval and some slack
+SNAPSHOT_EXTRAPOLATION_LIMIT = 250 # ms a late board is extrapolated for before the objects wait for it
+SNAPSHOT_MAX_GAP = 500 # ms between two boards, a longer gap is a new turn and is not interpolated across
+SNAPSHOT_TELEPORT_DISTANCE = 20 # pixels an object may move beyond what its speed explains before it is snapped
+SNAPSHOT_BUFFER_SIZE = 32
+CLOCK_OFFSET_WINDOW = 120 # boards the opponent's clock offset is estimated over
+
+MATCHMAKING_INTERVAL = 250 # ms between two matching batches on the server
+MATCHMAKING_RATING_BUCKET_WIDTH = 100
+MATCHMAKING_RTT_BUCKETS = (50, 100, 200) # ms, upper bounds of every rtt bucket but the last
+MATCHMAKING_WIDEN_INTERVAL = 5 # seconds of waiting after which a player may be paired one more bucket away
+MATCHMAKING_COMPACT_SLACK = 64 # cancelled tickets a queue may hold beyond its waiting ones before it is rebuilt
+
+SERVER_TICK_INTERVAL = 16 # ms between two steps of the authoritative matches, each one covers the physics ticks due by then
+SERVER_MAX_SHOT_SPEED = 6000 # pixels per second, about a drag across the whole screen with the strongest booster
+PLAYER_WRITE_BUFFER_LIMIT = 64 * 1024 # bytes queued for a player of an authoritative match, beyond it its boards and drag previews are dropped
+PLAYER_MAX_WRITE_BUFFER = 1024 * 1024 # a player this far behind is disconnected
+SPECTATOR_WRITE_BUFFER_LIMIT = 64 * 1024 # bytes queued for a spectator, beyond it its boards and drag previews are dropped
+SPECTATOR_MAX_WRITE_BUFFER = 1024 * 1024 # a spectator this far behind is disconnected
+SERVER_MAX_MESSAGE_SIZE = 64 * 1024 # bytes, a client announcing a longer frame is disconnected instead of buffered for
+
 ##############################
 # Game constants
 ##############################
 
 FPS = 60
+ASSET_CACHE = True # decoded and scaled images and gifs are kept in assets/cache, build_assets.py fills it ahead of time
+TEXT_CACHE_SIZE = 64 # rendered texts kept for the scoreboard and the timer
+IDLE_FRAME_PACING = True # once nothing moves, frames wait for an input, a server message or the next second of the timer
+IDLE_FRAMES_BEFORE_WAITING = 30 # frames nothing moved in before the loop starts waiting, the jitter buffer needs a few to settle
+DIRTY_RECT_RENDERING = True # redraw and push to the display only the parts of the screen that changed since the last frame
+PHYSICS_HZ = 120 # physics always advances in fixed steps of 1 / PHYSICS_HZ seconds, independent of FPS
+PHYSICS_TIMESTEP = 1 / PHYSICS_HZ
+MAX_PHYSICS_STEPS_PER_FRAME = 8 # a slow frame drops the rest of its backlog instead of stalling further
 FRICTION_A = 80
 TURN_SECONDS = 120
 MINIMUM_OF_VELOCITY_TO_STOPPING_OBJECT = 5
+VECTORIZED_PHYSICS = True # keep all objects in contiguous arrays and step them with numpy
+BROAD_PHASE_MIN_OBJECTS = 32 # with fewer objects every pair is tested directly
+BROAD_PHASE_MARGIN_FACTOR = 3 # broad-phase boxes are grown by this many ticks of their own travel
+
+SHOT_EVALUATOR_BATCH_SIZE = 256 # shots simulated together as one engine, also the chunk size handed to each worker
+SHOT_EVALUATOR_MAX_TICKS = 30 * PHYSICS_HZ
+
+BOT_TURN_TIME_BUDGET = 0.2 # seconds the computer opponent may think about a shot
+BOT_SEARCH_BATCH_SIZE = 16
+BOT_SHOT_POWER_RANGE = (60, 400) # drag distance in pixels
+BOT_AIM_SPREAD = 0.25 # radians around the direction to the ball
+BOT_EXPLORATION_RATIO = 0.25
+BOT_REFINEMENT_RATIO = 0.5
+BOT_OWN_GOAL_DISTANCE_WEIGHT = 0.3
 
 GOAL_CEREMONY_TIME = 3500 # in miliseconds
 WINNER_CEREMONY_TIME = 6500
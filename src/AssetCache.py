@@ -0,0 +1,175 @@
+import pygame
+import numpy as np
+
+import glob
+import hashlib
+import json
+import os
+from typing import Callable
+
+
+def surface_to_array(surface: pygame.Surface) -> np.ndarray:
+    width, height = surface.get_size()
+    return np.frombuffer(pygame.image.tobytes(surface, "RGBA"), dtype=np.uint8).reshape(height, width, 4)
+
+
+def array_to_surface(array: np.ndarray) -> pygame.Surface:
+    height, width = array.shape[:2]
+    # convert_alpha copies the pixels, the surface does not keep the mapped file open
+    return pygame.image.frombuffer(np.ascontiguousarray(array), (width, height), "RGBA").convert_alpha()
+
+
+class AssetCache:
+    # decoded and scaled assets are kept on disk as raw rgba arrays, named by the hash of their source file and
+    # their target size, so a start maps them with np.load instead of decoding and scaling the sources again
+
+    VERSION = 1
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.source_hashes: dict[str, str] = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def source_hash(self, path: str) -> str:
+        if path not in self.source_hashes:
+            with open(path, "rb") as source:
+                self.source_hashes[path] = hashlib.sha1(source.read()).hexdigest()
+        return self.source_hashes[path]
+
+    def key(self, path: str, size: tuple[float, float] | None) -> str:
+        key = f"{AssetCache.VERSION} {self.source_hash(path)} {size}"
+        return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    def cache_path(self, name: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{name}.{extension}")
+
+    def read_array(self, name: str) -> np.ndarray | None:
+        try:
+            return np.load(self.cache_path(name, "npy"), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+    def read_json(self, name: str) -> dict | None:
+        try:
+            with open(self.cache_path(name, "json")) as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, name: str, extension: str, dump: Callable) -> bool:
+        # written next to the final name and moved over it, a half written file is never read
+        path = self.cache_path(name, extension)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + ".tmp", "wb" if extension == "npy" else "w") as cache_file:
+                dump(cache_file)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            # a read only install decodes its assets on every start, like without a cache
+            return False
+        return True
+
+    def write_array(self, name: str, array: np.ndarray) -> bool:
+        return self.write(name, "npy", lambda cache_file: np.save(cache_file, array))
+
+    def write_json(self, name: str, content: dict) -> bool:
+        return self.write(name, "json", lambda cache_file: json.dump(content, cache_file))
+
+    def remove_stale(self, prefix: str, name: str):
+        # older versions of the same source, they would never be read again
+        for path in glob.glob(os.path.join(glob.escape(self.directory), glob.escape(prefix) + "-*.npy")):
+            if os.path.basename(path) != f"{name}.npy":
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def load_frames(self, path: str, size: tuple[float, float] | None,
+                    decode: Callable[[], list[pygame.Surface]]) -> list[pygame.Surface]:
+        prefix = os.path.basename(path)
+        name = f"{prefix}-{self.key(path, size)}"
+        frames = self.read_array(name)
+        if frames is not None:
+            self.hits += 1
+            return [array_to_surface(frame) for frame in frames]
+
+        self.misses += 1
+        surfaces = decode()
+        if self.write_array(name, np.stack([surface_to_array(surface) for surface in surfaces])):
+            self.remove_stale(prefix, name)
+        return surfaces
+
+
+class SpriteAtlas:
+    # the small images share one pre-scaled atlas, a sprite whose source or size changed is decoded again
+    # and the atlas is rebuilt from this start's sprites once all of them are loaded
+
+    NAME = "sprites"
+    WIDTH = 1024
+
+    def __init__(self, cache: AssetCache):
+        self.cache = cache
+        self.surface: pygame.Surface | None = None
+        self.entries: dict[str, dict] = dict()
+        self.sprites: dict[str, tuple[str, pygame.Surface]] = dict()
+        self.is_stale = False
+        self.read()
+
+    def read(self):
+        # the index names the atlas array it was written with, so the two can never belong to different builds
+        index = self.cache.read_json(SpriteAtlas.NAME)
+        if index is None or index.get("version") != AssetCache.VERSION:
+            return
+        atlas = self.cache.read_array(index["atlas"])
+        if atlas is None:
+            return
+        height, width = atlas.shape[:2]
+        if not all(pygame.Rect(0, 0, width, height).contains(entry["rect"]) for entry in index["sprites"].values()):
+            return
+        self.surface = array_to_surface(atlas)
+        self.entries = index["sprites"]
+
+    def load(self, path: str, size: tuple[float, float] | None, decode: Callable[[], pygame.Surface]) -> pygame.Surface:
+        name = f"{os.path.basename(path)} {size}"
+        source = self.cache.source_hash(path)
+        entry = self.entries.get(name)
+        if entry is not None and entry["source"] == source:
+            self.cache.hits += 1
+            sprite = self.surface.subsurface(entry["rect"])
+        else:
+            self.cache.misses += 1
+            self.is_stale = True
+            sprite = decode()
+        self.sprites[name] = (source, sprite)
+        return sprite
+
+    def pack(self) -> tuple[dict[str, pygame.Rect], tuple[int, int]]:
+        # shelves of sprites, the tallest first, each row as high as its first sprite
+        rects = dict()
+        x = y = shelf_height = 0
+        for name, (_, sprite) in sorted(self.sprites.items(), key=lambda item: -item[1][1].get_height()):
+            width, height = sprite.get_size()
+            if x + width > SpriteAtlas.WIDTH:
+                x, y = 0, y + shelf_height
+                shelf_height = 0
+            rects[name] = pygame.Rect(x, y, width, height)
+            x += width
+            shelf_height = max(shelf_height, height)
+        return rects, (SpriteAtlas.WIDTH, y + shelf_height)
+
+    def save(self):
+        if not self.is_stale or not self.sprites:
+            return
+        rects, (width, height) = self.pack()
+        atlas = np.zeros((height, width, 4), dtype=np.uint8)
+        for name, (_, sprite) in self.sprites.items():
+            rect = rects[name]
+            atlas[rect.top:rect.bottom, rect.left:rect.right] = surface_to_array(sprite)
+        sprites = {name: {"source": source, "rect": list(rects[name])} for name, (source, _) in self.sprites.items()}
+        digest = hashlib.sha1(json.dumps(sprites, sort_keys=True).encode()).hexdigest()[:16]
+        name = f"{SpriteAtlas.NAME}-{digest}"
+        if (self.cache.write_array(name, atlas) and
+                self.cache.write_json(SpriteAtlas.NAME, {"version": AssetCache.VERSION, "atlas": name, "sprites": sprites})):
+            self.cache.remove_stale(SpriteAtlas.NAME, name)
+            self.is_stale = False
@@ -16,11 +16,8 @@ class Ball(Object):
     def __init__(self, game:'Game', pos: np.ndarray, velocity: np.ndarray):
         super().__init__(game, Ball.MASS, Ball.RADIUS, pos, velocity)
     
-    def draw(self, screen: pygame.Surface):
-        image = self.game.media.ball_image
-        image_rect = image.get_rect(center=self.pos)
-
-        screen.blit(image, image_rect.topleft)
+    def get_image(self) -> pygame.Surface:
+        return self.game.media.ball_image
 
     def collision_object_play_sound(self, other=None):
         super().collision_object_play_sound(other)
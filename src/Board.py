@@ -5,8 +5,12 @@ from .Player import Player, GoalKeeper, Defender, Striker, Side
 from .Ball import Ball
 from .Object import Object
 import settings
-from .Models import ObjectModel, MouseModel, BoardUpdate
+from .Models import ObjectModel, MouseModel, BoardUpdate, CollisionEvent, Shot
 from .Mouse import Mouse
+from .Physics import PhysicsEngine
+from .Protocol import PackedBoardUpdate
+from .Renderer import Sprite
+from .Simulation import Simulation, ShotOutcome
 
 from typing import TYPE_CHECKING
 
@@ -18,6 +22,9 @@ class Board:
     def __init__(self, game):
         self.game: Game = game
         self.mouse = Mouse(self.game)
+        self.physics = PhysicsEngine()
+        self.simulation: Simulation | None = None
+        self.scoreboard: Sprite | None = None
         self.ball: Ball = None
         self.left_goalkeeper: GoalKeeper = None
         self.left_defenders: list[Defender] = []
@@ -25,22 +32,30 @@ class Board:
         self.right_goalkeeper: GoalKeeper = None
         self.right_defenders: list[Defender] = []
         self.right_strikers: list[Striker] = []
+        self.cache_object_lists()
+
+    def cache_object_lists(self):
+        # the objects are only created once, every frame reads these instead of concatenating them again
+        self._left_players = self.left_strikers + self.left_defenders + [self.left_goalkeeper]
+        self._right_players = self.right_strikers + self.right_defenders + [self.right_goalkeeper]
+        self._all_players = self._left_players + self._right_players
+        self._all_objects = self._all_players + [self.ball]
 
     @property
     def left_players(self) -> list[Player]:
-        return self.left_strikers + self.left_defenders + [self.left_goalkeeper]
+        return self._left_players
 
     @property
     def right_players(self) -> list[Player]:
-        return self.right_strikers + self.right_defenders + [self.right_goalkeeper]
+        return self._right_players
 
     @property
     def all_players(self) -> list[Player]:
-        return self.left_players + self.right_players
+        return self._all_players
     
     @property
     def all_objects(self) -> list[Object]:
-        return self.all_players + [self.ball]
+        return self._all_objects
     
     def init_screen(self):
         self.screen = pygame.display.set_mode((settings.SCREEN_WIDTH, settings.SCREEN_HEIGHT))
@@ -97,6 +112,10 @@ class Board:
     def init_objects(self):
         self.init_ball()
         self.init_players()
+        self.cache_object_lists()
+        if settings.VECTORIZED_PHYSICS:
+            self.physics.bind_objects(self.all_objects)
+            self.simulation = Simulation.from_board(self)
 
     def reset_players_state(self):
         left_coordinates = settings.LEFT_SIDE_COORDINATES
@@ -130,8 +149,52 @@ class Board:
     def reset_board_state(self):
         self.reset_ball_state()
         self.reset_players_state()
+        self.snap_render_positions()
+
+    def update_objects_legacy(self):
+        objects = self.all_objects
+        for obj in objects:
+            obj.pre_update_velocity()
+        
+        for obj in objects:
+            obj.update_velocity()
+
+        for obj in objects:
+            obj.update_pos()
+
+    def snap_render_positions(self):
+        if self.simulation is not None:
+            self.physics.snap_render_positions()
+
+    def interpolate_render_positions(self, alpha: float):
+        if self.simulation is not None:
+            self.physics.interpolate_render_positions(alpha)
+
+    def show_render_positions(self, ids: np.ndarray, pos: np.ndarray):
+        # only the drawn positions, the simulated ones are left alone
+        if self.simulation is not None:
+            self.physics.render_pos[self.simulation.slot_of_id[ids]] = pos
+
+    def update_objects(self) -> list[CollisionEvent]:
+        if self.simulation is None:
+            self.update_objects_legacy()
+            return []
+        return self.simulation.step(self.game.DT)
+
+    def snapshot_simulation(self) -> Simulation:
+        # detached copy of the current state, stepping it never touches the drawn objects
+        if self.simulation is not None:
+            return self.simulation.copy()
+        simulation = Simulation.create_initial()
+        simulation.load_board(self.dump_board())
+        return simulation
+
+    def simulate_shot_until_idle(self, shot: Shot) -> ShotOutcome:
+        return self.snapshot_simulation().simulate_until_idle(shot)
 
     def is_idle(self) -> bool:
+        if self.physics.is_bound:
+            return self.physics.is_idle()
         for obj in self.all_objects:
             if obj.velocity.any():
                 return False
@@ -151,61 +214,111 @@ class Board:
         for object in objects:
             object.draw(self.screen)
 
+    def object_sprites(self, objects: list[Object]) -> list[Sprite]:
+        sprites = []
+        for obj in objects:
+            image = obj.get_image()
+            sprites.append(Sprite.from_surface(("object", obj.id), image, obj.get_image_rect(image)))
+        return sprites
+
+    def shot_hint_sprite(self, start: tuple[float, float], end: tuple[float, float]) -> Sprite:
+        width = 4
+        rect = pygame.Rect(min(start[0], end[0]), min(start[1], end[1]), abs(end[0] - start[0]) + 1, abs(end[1] - start[1]) + 1)
+        draw = lambda screen: pygame.draw.line(surface=screen, color=(255, 255, 255), start_pos=start, end_pos=end, width=width)
+        return Sprite("shot_hint", rect.inflate(2 * width, 2 * width), (start, end), draw)
+
+    def render_text(self, text: str, font: pygame.font.Font, color: str, center: tuple[int, int]) -> tuple[pygame.Surface, pygame.Rect]:
+        surface = self.game.media.text_cache.render(font, text, color)
+        return surface, surface.get_rect(center=center)
+
+    def text_sprite(self, key: str, text: str, font: pygame.font.Font, color: str, center: tuple[int, int]) -> Sprite:
+        surface, rect = self.render_text(text, font, color, center)
+        return Sprite.from_surface(key, surface, rect, text)
+
+    def sprites(self, shot_hint: tuple[tuple[float, float], tuple[float, float]] | None) -> tuple[list[Sprite], list[Sprite]]:
+        # what is drawn under the goal nets and what over them, in the order of Game.pygame_draw
+        below = [self.shot_hint_sprite(*shot_hint)] if shot_hint else []
+        below += self.object_sprites(self.all_objects)
+        above = [self.scoreboard_sprite(), self.timer_sprite()] + self.ceremony_sprites()
+        return below, above
+
     def draw_goals(self):
         self.screen.blit(self.game.media.goals_transparent_image, (0, 0))
 
     def show_screen(self):
         self.screen.blit(self.game.media.pitch_image, (0, 0))
 
+    def winner_ceremony_gif(self, winner) -> list[pygame.Surface]:
+        if winner == Side.RED:
+            return self.game.media.red_winning_ceremony_gif
+        elif winner == Side.BLUE:
+            return self.game.media.blue_winning_ceremony_gif
+        raise Exception("winner is None. can't play winner ceremony")
+
     def show_goal_ceremony(self):
         gif = self.game.media.goal_ceremony_gif
         end_time = self.game.rules_freezed_for_ceremony_finish_time
-        self.game.media.play_gif(gif, end_time, self.screen)
+        self.game.media.play_gif(gif, end_time, self.game.clock.get_ticks(), self.screen)
         
     def show_winner_ceremony(self, winner):
-        if winner == Side.RED:
-            gif = self.game.media.red_winning_ceremony_gif
-        elif winner == Side.BLUE:
-            gif = self.game.media.blue_winning_ceremony_gif
-        else:
-            raise Exception("winner is None. can't play winner ceremony")
-        
+        gif = self.winner_ceremony_gif(winner)
         end_time = self.game.rules_freezed_for_ceremony_finish_time
-        self.game.media.play_gif(gif, end_time, self.screen)
-
-    def show_names(self):
-        red_name = self.game.left_side_name
-        red_name_surface = self.game.media.font.render(red_name, True, "grey")
-        red_name_rect = red_name_surface.get_rect(center=settings.SCOREBAR_PLACE_RED_NAME)
-        self.screen.blit(red_name_surface, red_name_rect)
-
-        blue_name = self.game.right_side_name
-        blue_name_surface = self.game.media.font.render(blue_name, True, "grey")
-        blue_name_rect = blue_name_surface.get_rect(center=settings.SCOREBAR_PLACE_BLUE_NAME)
-        self.screen.blit(blue_name_surface, blue_name_rect)
-
-    def show_scores(self):
-        red_score = str(self.game.scores[Side.RED])
-        red_score_surface = self.game.media.large_font.render(red_score, True, "white")
-        red_score_rect = red_score_surface.get_rect(center=settings.SCOREBAR_PLACE_RED_SCORE)
-        self.screen.blit(red_score_surface, red_score_rect)
-
-        blue_score = str(self.game.scores[Side.BLUE])
-        blue_score_surface = self.game.media.large_font.render(blue_score, True, "white")
-        blue_score_rect = blue_score_surface.get_rect(center=settings.SCOREBAR_PLACE_BLUE_SCORE)
-        self.screen.blit(blue_score_surface, blue_score_rect)
+        self.game.media.play_gif(gif, end_time, self.game.clock.get_ticks(), self.screen)
 
-    def show_timer(self):
-        remained_seconds = self.game.turn_last_second - pygame.time.get_ticks()//1000
+    def ceremony_sprites(self) -> list[Sprite]:
+        if self.game.is_goal_ceremony_running():
+            gif = self.game.media.goal_ceremony_gif
+        elif self.game.is_winner_ceremony_running():
+            gif = self.winner_ceremony_gif(self.game.winner)
+        else:
+            return []
+        end_time = self.game.rules_freezed_for_ceremony_finish_time
+        image, image_rect = self.game.media.gif_frame(gif, end_time, self.game.clock.get_ticks())
+        return [Sprite.from_surface("ceremony", image, image_rect)]
+
+    def name_texts(self) -> list[tuple[pygame.Surface, pygame.Rect]]:
+        font = self.game.media.font
+        return [
+            self.render_text(self.game.left_side_name, font, "grey", settings.SCOREBAR_PLACE_RED_NAME),
+            self.render_text(self.game.right_side_name, font, "grey", settings.SCOREBAR_PLACE_BLUE_NAME),
+        ]
+
+    def score_texts(self) -> list[tuple[pygame.Surface, pygame.Rect]]:
+        font = self.game.media.large_font
+        return [
+            self.render_text(str(self.game.scores[Side.RED]), font, "white", settings.SCOREBAR_PLACE_RED_SCORE),
+            self.render_text(str(self.game.scores[Side.BLUE]), font, "white", settings.SCOREBAR_PLACE_BLUE_SCORE),
+        ]
+
+    def scoreboard_sprite(self) -> Sprite:
+        # names and scores are composited into one strip, which is only built again when one of them changes
+        state = (self.game.left_side_name, self.game.right_side_name, self.game.scores[Side.RED], self.game.scores[Side.BLUE])
+        if self.scoreboard is None or self.scoreboard.state != state:
+            texts = self.score_texts() + self.name_texts()
+            rect = texts[0][1].unionall([text_rect for _, text_rect in texts[1:]])
+            strip = pygame.Surface(rect.size, pygame.SRCALPHA)
+            for surface, text_rect in texts:
+                # the strip is transparent, the max copies the text pixels instead of blending them with its black
+                strip.blit(surface, text_rect.move(-rect.x, -rect.y), special_flags=pygame.BLEND_RGBA_MAX)
+            # run length encoded, blitting it skips the transparent gaps between the texts
+            strip.set_alpha(255, pygame.RLEACCEL)
+            self.scoreboard = Sprite.from_surface("scoreboard", strip, rect, state)
+        return self.scoreboard
+
+    def timer_text(self) -> str:
+        remained_seconds = self.game.turn_last_second - self.game.clock.get_ticks()//1000
         minutes = str(remained_seconds // 60).zfill(2)
         seconds = str(remained_seconds % 60).zfill(2)
-        surface = self.game.media.font.render(f"{minutes}:{seconds}", True, "white")
-        rect = surface.get_rect(center=settings.TIMER_COORDINATES)
-        self.screen.blit(surface, rect)
+        return f"{minutes}:{seconds}"
+
+    def timer_sprite(self) -> Sprite:
+        return self.text_sprite("timer", self.timer_text(), self.game.media.font, "white", settings.TIMER_COORDINATES)
+
+    def show_timer(self):
+        self.timer_sprite().draw(self.screen)
 
     def show_scoreboard(self):
-        self.show_scores()
-        self.show_names()
+        self.scoreboard_sprite().draw(self.screen)
 
     def dump_board(self) -> BoardUpdate:
         mouse = self.mouse.dump_mouse()
@@ -214,10 +327,37 @@ class Board:
             objects.append(obj.dump_object())
         return BoardUpdate(mouse=mouse, objects=objects)
     
-    def load_board(self, board: BoardUpdate):
-        self.mouse.load_mouse(board.mouse)
-        for obj in board.objects:
-            Object.objects_list[obj.id].load_object(obj)
+    def load_board(self, board: BoardUpdate | PackedBoardUpdate):
+        # a delta update only carries the objects that changed, the rest stay as the previous update left them
+        if isinstance(board, PackedBoardUpdate):
+            self.load_packed_board(board)
+        else:
+            self.mouse.load_mouse(board.mouse)
+            for obj in board.objects:
+                Object.objects_list[obj.id].load_object(obj)
+        self.snap_render_positions()
+
+    def dump_packed_board(self) -> PackedBoardUpdate:
+        if self.simulation is not None:
+            return self.simulation.dump_packed_board(self.mouse.pos, self.mouse.status)
+        objects = self.all_objects
+        return PackedBoardUpdate.from_arrays(
+            self.mouse.pos, self.mouse.status,
+            np.array([obj.id for obj in objects]),
+            np.array([obj.pos for obj in objects]),
+            np.array([obj.velocity for obj in objects]),
+        )
+
+    def load_packed_board(self, board: PackedBoardUpdate):
+        self.mouse.pos = np.array(board.mouse_pos, dtype=int)
+        self.mouse.status = board.mouse_status
+        if self.simulation is not None:
+            self.simulation.load_packed_board(board)
+            return
+        for object_id, x, y, velocity_x, velocity_y in board.objects.tolist():
+            obj = Object.objects_list[object_id]
+            obj.pos = np.array((x, y), dtype=float)
+            obj.velocity = np.array((velocity_x, velocity_y))
 
 
     
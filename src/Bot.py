@@ -0,0 +1,114 @@
+import numpy as np
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+import os
+import time
+
+from .Models import Shot, Velocity
+from .Player import Side
+from .ShotEvaluator import simulate_shots_batch
+from .Simulation import Simulation
+import settings
+
+
+def goal_center(side: Side) -> np.ndarray:
+    # the goal that side is defending
+    x = settings.PITCH_LEFT_BORDER if side == Side.RED else settings.PITCH_RIGHT_BORDER
+    return np.array([x, (settings.GOAL_UP_BORDER + settings.GOAL_DOWN_BORDER) / 2])
+
+
+def score_shot_table(simulation: Simulation, table: np.ndarray, side: Side) -> np.ndarray:
+    opponent = Side.RED if side == Side.BLUE else Side.BLUE
+    ball = table["pos"][:, simulation.ball_slot]
+    to_opponent_goal = np.linalg.norm(ball - goal_center(opponent), axis=1)
+    to_own_goal = np.linalg.norm(ball - goal_center(side), axis=1)
+    scores = to_own_goal * settings.BOT_OWN_GOAL_DISTANCE_WEIGHT - to_opponent_goal
+    scores[table["scored_side"] == side.value] = np.inf
+    scores[table["scored_side"] == opponent.value] = -np.inf
+    scores[table["is_cut_off"]] = -np.inf
+    return scores
+
+
+def candidate_shots(simulation: Simulation, side: Side, rng: np.random.Generator, count: int,
+                    best: tuple[int, float, float] | None):
+    slots = np.flatnonzero(simulation.sides == side.value)
+    picked = rng.choice(slots, count)
+    pos = simulation.physics.pos
+    to_ball = pos[simulation.ball_slot] - pos[picked]
+    angles = np.arctan2(to_ball[:, 1], to_ball[:, 0]) + rng.normal(0, settings.BOT_AIM_SPREAD, count)
+    powers = rng.uniform(*settings.BOT_SHOT_POWER_RANGE, count)
+
+    explore = rng.random(count) < settings.BOT_EXPLORATION_RATIO
+    angles[explore] = rng.uniform(-np.pi, np.pi, explore.sum())
+
+    if best is not None:
+        # the rest refines around the best shot found so far
+        refine = rng.random(count) < settings.BOT_REFINEMENT_RATIO
+        object_id, angle, power = best
+        picked[refine] = simulation.slots[object_id]
+        angles[refine] = angle + rng.normal(0, settings.BOT_AIM_SPREAD / 4, refine.sum())
+        powers[refine] = np.clip(power + rng.normal(0, 20, refine.sum()), *settings.BOT_SHOT_POWER_RANGE)
+
+    return simulation.physics.ids[picked], angles, powers
+
+
+def search_best_shot(simulation: Simulation, side: Side, time_budget: float, seed: int) -> tuple[float, Shot | None]:
+    # anytime search: keeps evaluating small batches and stops before a new batch would miss the deadline,
+    # a batch that runs into it anyway stops where it is and only its settled shots are scored
+    deadline = time.perf_counter() + time_budget
+    rng = np.random.default_rng(seed)
+    best_score, best = -np.inf, None
+    batch_duration = 0.0
+
+    while best is None or time.perf_counter() + batch_duration < deadline:
+        batch_start = time.perf_counter()
+        object_ids, angles, powers = candidate_shots(simulation, side, rng, settings.BOT_SEARCH_BATCH_SIZE, best)
+        table = simulate_shots_batch(simulation, object_ids, angles, powers, deadline=deadline)
+        scores = score_shot_table(simulation, table, side)
+        index = int(np.argmax(scores))
+        if best is None or scores[index] > best_score:
+            best_score = scores[index]
+            best = (int(object_ids[index]), float(angles[index]), float(powers[index]))
+        if best_score == np.inf:
+            break
+        batch_duration = time.perf_counter() - batch_start
+
+    object_id, angle, power = best
+    speed = simulation.shot_boosters[simulation.slots[object_id]] * power
+    shot = Shot(object_id=object_id, velocity=Velocity(x=speed * np.cos(angle), y=speed * np.sin(angle)))
+    return best_score, shot
+
+
+class Bot:
+
+    def __init__(self, side: Side, time_budget: float = settings.BOT_TURN_TIME_BUDGET, workers: int | None = None):
+        self.side = side
+        self.time_budget = time_budget
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self._futures: list[Future] = []
+        self._seed = 0
+        # the search never runs on the render loop, a single core still gets a background thread
+        self._executor: Executor = (
+            ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else ThreadPoolExecutor(max_workers=1)
+        )
+
+    def is_thinking(self) -> bool:
+        return bool(self._futures)
+
+    def start_thinking(self, simulation: Simulation):
+        # every worker searches the same snapshot with its own seed, the best answer wins
+        self._futures = [
+            self._executor.submit(search_best_shot, simulation, self.side, self.time_budget, self._seed + worker)
+            for worker in range(self.workers)
+        ]
+        self._seed += self.workers
+
+    def poll_shot(self) -> Shot | None:
+        if not self._futures or not all(future.done() for future in self._futures):
+            return None
+        results = [future.result() for future in self._futures]
+        self._futures = []
+        return max(results, key=lambda result: result[0])[1]
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+        self._futures = []
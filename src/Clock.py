@@ -0,0 +1,39 @@
+import pygame
+
+
+class PygameClock:
+
+    def __init__(self):
+        self.clock = pygame.time.Clock()
+
+    def get_ticks(self) -> int:
+        return pygame.time.get_ticks()
+
+    def tick(self, fps: int) -> int:
+        return self.clock.tick(fps)
+
+    def wait_for_event(self, timeout: int) -> pygame.event.Event:
+        return pygame.event.wait(timeout)
+
+
+class ManualClock:
+    # advances only when ticked, so headless games run as fast as the cpu allows
+
+    def __init__(self, start_ticks: int = 0):
+        self.ticks = start_ticks
+
+    def get_ticks(self) -> int:
+        return int(self.ticks)
+
+    def advance(self, milliseconds: float):
+        self.ticks += milliseconds
+
+    def tick(self, fps: int) -> float:
+        frame_time = 1000 / fps
+        self.advance(frame_time)
+        return frame_time
+
+    def wait_for_event(self, timeout: int) -> pygame.event.Event:
+        # the time just passes, nothing arrives while waiting for it
+        self.advance(timeout)
+        return pygame.event.Event(pygame.NOEVENT)
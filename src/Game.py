@@ -5,7 +5,13 @@ from .Board import Board
 from .Player import Side, GoalKeeper, Defender, Striker
 from .Media import MediaLoader
 from .Mouse import Mouse
+from .Object import Object
+from .Clock import PygameClock
+from .Bot import Bot
+from .SnapshotInterpolator import SnapshotInterpolator
+from .Renderer import DirtyRectRenderer
 import settings
+from utils.time import now_time
 
 
 from typing import TYPE_CHECKING
@@ -15,36 +21,49 @@ if TYPE_CHECKING:
     from .Ball import Ball
 
 
-from .Models import User, Match
+from .Models import User, Match, CollisionEvent, Shot, DragPreview, TurnEnd, NetworkMode, Position
 
 class Game:
 
     FIRST_TURN = Side.RED
-    DT = 15
+    DT = settings.PHYSICS_TIMESTEP
+    WAKE_UP_EVENT = pygame.event.custom_type()
+    # the events the game loop reads from the queue, the others are dropped before waiting for one
+    HANDLED_EVENTS = (pygame.QUIT, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.WINDOWEXPOSED)
 
     def pygame_init(self):
         pygame.init()
         pygame.mixer.init()
         pygame.font.init()
-        self.clock = pygame.time.Clock()
         self.board.init_screen()
 
     def pygame_quit(self):
         pygame.quit()
 
+    def exit_game(self):
+        # the socket client logs the match's send counters before it closes
+        if self.is_multiplayer:
+            self.socket.exit_game()
+        self.pygame_quit()
+        exit()
+
     def load_assets(self):
         self.media = MediaLoader()
         self.media.load_assets()
+        if settings.DIRTY_RECT_RENDERING:
+            self.renderer = DirtyRectRenderer(self.board.screen, self.media.pitch_image, self.media.goals_transparent_image)
 
 
     __singleton = False
-    def __init__(self, is_multiplayer=False, socket_client=None):
+    def __init__(self, is_multiplayer=False, socket_client=None, clock=None, bot_side: Side | None = None):
         if Game.__singleton:
             raise Exception("Game is singleton, more than one instance is not allowed")
         Game.__singleton = True
         
         self.is_multiplayer = is_multiplayer
         self.socket = socket_client
+        self.clock = clock or PygameClock()
+        self.bot = Bot(bot_side) if bot_side is not None else None
 
         self.turn = None
         self.scored_side = None
@@ -59,9 +78,18 @@ class Game:
         self.is_finished = False
         self.turn_last_second = settings.TURN_SECONDS
         self._prev_frame_board_was_idle : bool | None = True
+        self.physics_time_accumulator = 0.0
+        self.last_drag_preview_sent_time = 0
+        self.snapshot_interpolator: SnapshotInterpolator | None = None
+        self.renderer: DirtyRectRenderer | None = None
+        self.dirty_rects: list[pygame.Rect] = []
+        self.shot_hint: tuple[tuple[float, float], tuple[float, float]] | None = None
+        self.idle_frames = 0
+        if self.socket is not None:
+            self.socket.on_inbound = self.wake_up
 
     def is_ceremony_running(self) -> bool:
-        return self.rules_freezed_for_ceremony_finish_time > pygame.time.get_ticks()
+        return self.rules_freezed_for_ceremony_finish_time > self.clock.get_ticks()
     
     def is_winner_ceremony_running(self) -> bool:
         return self.is_ceremony_running() and self.is_finished
@@ -74,8 +102,11 @@ class Game:
                 player.put_player_out_of_the_goal()
         self.board.left_goalkeeper.keep_goalkeeper_in_penalty_area()
         self.board.right_goalkeeper.keep_goalkeeper_in_penalty_area()
+        self.board.snap_render_positions()
+        if self.snapshot_interpolator is not None:
+            self.snapshot_interpolator.clear()
 
-        self.turn_last_second = pygame.time.get_ticks()//1000 + settings.TURN_SECONDS
+        self.turn_last_second = self.clock.get_ticks()//1000 + settings.TURN_SECONDS
 
         if self.scored_side is None:
             self.swap_turn()
@@ -86,22 +117,45 @@ class Game:
         self.scored_side = None
 
     def is_turns_times_up(self):
-        return self.turn_last_second <= pygame.time.get_ticks()//1000
+        return self.turn_last_second <= self.clock.get_ticks()//1000
 
-    def update_in_my_turn(self):
-        objects = self.board.all_objects
-        for obj in objects:
-            obj.pre_update_velocity()
-        
-        for obj in objects:
-            obj.update_velocity()
+    def play_collision_sounds(self, events: list[CollisionEvent]):
+        for event in events:
+            obj = Object.objects_list[event.first_id]
+            if event.is_border_collision():
+                obj.collision_object_play_sound()
+            else:
+                other = Object.objects_list[event.second_id]
+                obj.collision_object_play_sound(other)
+                other.collision_object_play_sound(obj)
 
-        for obj in objects:
-            obj.update_pos()
+    def step_physics(self):
+        steps = 0
+        while self.physics_time_accumulator >= self.DT and steps < settings.MAX_PHYSICS_STEPS_PER_FRAME:
+            events = self.board.update_objects()
+            self.play_collision_sounds(events)
+            self.physics_time_accumulator -= self.DT
+            steps += 1
 
-        if (not self._prev_frame_board_was_idle and self.board.is_idle()) or (self.is_turns_times_up() and self.board.is_idle()):
+        if steps == settings.MAX_PHYSICS_STEPS_PER_FRAME:
+            self.physics_time_accumulator = min(self.physics_time_accumulator, self.DT)
+
+        self.board.interpolate_render_positions(self.physics_time_accumulator / self.DT)
+
+    def update_in_my_turn(self):
+        self.step_physics()
+
+        is_idle = self.board.is_idle()
+        if is_idle and (not self._prev_frame_board_was_idle or self.is_turns_times_up()):
             self.end_of_turn_jobs()
+            if self.is_lockstep():
+                self.send_turn_end()
+
+        self._prev_frame_board_was_idle = is_idle
 
+    def update_in_opponent_turn_lockstep(self):
+        # same deterministic steps as the shooter, the turn only ends when the shooter says so
+        self.step_physics()
         self._prev_frame_board_was_idle = self.board.is_idle()
 
     def update_in_opponent_turn(self):
@@ -114,39 +168,141 @@ class Game:
         self._prev_frame_board_was_idle = self.board.is_idle()
 
     def update(self):
+        if self.is_authoritative():
+            # the server moves the objects, the drawn positions come from its boards
+            return
+
         if (self.is_multiplayer and self.turn == self.socket.side) or not self.is_multiplayer:
             self.update_in_my_turn()
-        
+
+        elif self.is_lockstep():
+            self.update_in_opponent_turn_lockstep()
+
         else:
             self.update_in_my_turn()
 
     def swap_turn(self):
         self.turn = Side.RED if self.turn == Side.BLUE else Side.BLUE
 
+    def apply_shot(self, shot: Shot):
+        Object.objects_list[shot.object_id].velocity = shot.velocity.to_ndarray()
+
+    def is_lockstep(self) -> bool:
+        return self.is_multiplayer and self.socket.network_mode == NetworkMode.LOCKSTEP
+
+    def is_authoritative(self) -> bool:
+        return self.is_multiplayer and self.socket.network_mode == NetworkMode.AUTHORITATIVE
+
+    def exchanges_shots(self) -> bool:
+        # shots and drag previews go over the network instead of the whole board
+        return self.is_lockstep() or self.is_authoritative()
+
+    def is_remote_shot_turn(self) -> bool:
+        return self.exchanges_shots() and self.turn != self.socket.side
+
+    def is_spectating(self) -> bool:
+        return self.is_multiplayer and self.socket.side is None
+
+    def send_turn_end(self):
+        # the final board also covers anything the two simulations could disagree on, like a timed out turn
+        board = self.board.dump_packed_board()
+        # both sides start the next turn from the same quantized board, so they keep simulating in lockstep
+        self.board.load_board(board)
+        turn_end = TurnEnd(
+            board=board.to_board_update(),
+            turn=self.turn.value,
+            red_score=self.scores[Side.RED],
+            blue_score=self.scores[Side.BLUE]
+        )
+        self.socket.send_turn_end_to_opponent(turn_end)
+
+    def apply_turn_end(self, turn_end: TurnEnd):
+        self.board.load_board(turn_end.board)
+        self.scores[Side.RED], self.scores[Side.BLUE] = turn_end.red_score, turn_end.blue_score
+        self.turn = Side(turn_end.turn)
+        self.turn_last_second = self.clock.get_ticks()//1000 + settings.TURN_SECONDS
+        self.scored_side = None
+        self.dragged_player = None
+        self._prev_frame_board_was_idle = True
+
+    def send_drag_preview(self):
+        if self.clock.get_ticks() - self.last_drag_preview_sent_time < settings.DRAG_PREVIEW_SEND_INTERVAL:
+            return
+        self.last_drag_preview_sent_time = self.clock.get_ticks()
+        x, y = self.dragging_mouse_pos
+        self.socket.send_drag_preview_to_opponent(
+            DragPreview(object_id=self.dragged_player.id, mouse_pos=Position(x=x, y=y))
+        )
+
+    def apply_server_turn_end(self, turn_end: TurnEnd):
+        # the server counts the goals, a score higher than ours is one to celebrate
+        for side, score in ((Side.RED, turn_end.red_score), (Side.BLUE, turn_end.blue_score)):
+            if score > self.scores[side]:
+                self.scored(side)
+        self.apply_turn_end(turn_end)
+        if self.snapshot_interpolator is not None:
+            self.snapshot_interpolator.clear()
+
+    def handle_opponent_event(self, event_name: str, content):
+        match event_name:
+            case "drag_preview":
+                self.dragged_player = Object.objects_list[content.object_id]
+                self.dragging_mouse_pos = content.mouse_pos.to_ndarray()
+            case "shot":
+                self.dragged_player = None
+                self.apply_shot(content)
+            case "turn_end" if self.is_authoritative():
+                self.apply_server_turn_end(content)
+            case "turn_end":
+                self.apply_turn_end(content)
+
+    def is_bot_turn(self) -> bool:
+        return self.bot is not None and self.turn == self.bot.side
+
+    def play_bot_turn(self):
+        if not self.is_bot_turn() or self.is_ceremony_running() or not self.board.is_idle():
+            return
+        if not self.bot.is_thinking():
+            self.bot.start_thinking(self.board.snapshot_simulation())
+            return
+        shot = self.bot.poll_shot()
+        if shot is not None:
+            self.apply_shot(shot)
+
     def start_dragging_player(self, player):
         self.dragged_player = player
 
     def releasing_dragged_player_shot(self):
-        releasing_force_booster = 2.5
-        if isinstance(self.dragged_player, Striker):
-            releasing_force_booster = 3.5
-        self.dragged_player.velocity = releasing_force_booster*(self.dragged_player.pos - self.dragging_mouse_pos).astype(np.longdouble)
+        shot = self.dragged_player.make_shot(self.dragging_mouse_pos)
+        if not self.is_authoritative():
+            self.dragged_player.velocity = shot.velocity.to_ndarray()
+        if self.exchanges_shots():
+            self.socket.send_shot_to_opponent(shot)
         self.dragged_player = None
         self.dragging_mouse_pos = None
         # self.swap_turn()
 
     def draw_dragged_player_shot_hint(self, mouse):
         self.dragging_mouse_pos = mouse.get_pos()
-        
-        pygame.draw.line(
-                surface=self.board.screen,
-                color=(255, 255, 255),
-                start_pos=self.dragged_player.pos,
-                end_pos=self.dragged_player.pos*2 - self.dragging_mouse_pos,
-                width=4
-            )
+        if self.exchanges_shots():
+            self.send_drag_preview()
+        self.draw_shot_hint()
+
+    def draw_shot_hint(self):
+        # drawn with the rest of the frame, under the objects
+        start = self.dragged_player.pos
+        end = self.dragged_player.pos*2 - self.dragging_mouse_pos
+        self.shot_hint = ((float(start[0]), float(start[1])), (float(end[0]), float(end[1])))
 
     def pygame_event_mouse_related(self):
+        if self.is_bot_turn():
+            return
+
+        if self.is_remote_shot_turn() or self.is_spectating():
+            if self.dragged_player:
+                self.draw_shot_hint()
+            return
+
         if self.board.mouse.is_click_down():
             players = self.board.all_players
             for player in players:
@@ -165,20 +321,78 @@ class Game:
 
     def pygame_event_exit(self):
         if pygame.event.get(pygame.QUIT):
-            exit()
+            self.exit_game()
+
+    def pygame_event_window(self):
+        # the window was covered or restored, what the dirty rects kept on it may be gone
+        if pygame.event.get(pygame.WINDOWEXPOSED) and self.renderer is not None:
+            self.renderer.invalidate()
+
+    def pygame_event_wake_up(self):
+        if pygame.event.get(Game.WAKE_UP_EVENT):
+            self.idle_frames = 0
 
     def pygame_event_handle(self):
         self.pygame_event_exit()
 
+        self.pygame_event_window()
+
+        self.pygame_event_wake_up()
+
         self.pygame_event_mouse_related()
     
     def pygame_refresh_background(self):
-        self.board.show_screen()
-
-    def pygame_clock_tick_set_dt(self):
-        self.DT = self.clock.tick(settings.FPS) / 1000.0
+        # the dirty rect renderer restores only what it redraws
+        if self.renderer is None:
+            self.board.show_screen()
+
+    def is_frame_idle(self) -> bool:
+        return (self.board.is_idle() and self.dragged_player is None and
+                not self.is_ceremony_running() and not self.is_bot_turn())
+
+    def count_idle_frames(self):
+        self.idle_frames = self.idle_frames + 1 if self.is_frame_idle() else 0
+
+    def wake_up(self):
+        # called from the network thread, posting an event is thread safe, but only between pygame_init and pygame_quit
+        if pygame.get_init():
+            pygame.event.post(pygame.event.Event(Game.WAKE_UP_EVENT))
+
+    def pygame_wait_while_idle(self) -> bool:
+        # nothing has moved for a while and nobody drags, so instead of drawing the same frame again
+        # the loop sleeps until an input, a message from the server or the next second of the turn timer
+        if not settings.IDLE_FRAME_PACING or self.idle_frames < settings.IDLE_FRAMES_BEFORE_WAITING:
+            return False
+        pygame.event.get(exclude=Game.HANDLED_EVENTS + (Game.WAKE_UP_EVENT,))
+        if pygame.event.peek(Game.HANDLED_EVENTS + (Game.WAKE_UP_EVENT,)):
+            return False
+        event = self.clock.wait_for_event(1000 - self.clock.get_ticks() % 1000)
+        if event.type == pygame.NOEVENT:
+            # only the timer changed, the next frame waits again
+            return True
+        # back to the full frame rate, the input may start a drag or the message a move
+        self.idle_frames = 0
+        if event.type in Game.HANDLED_EVENTS:
+            pygame.event.post(event)
+        return True
+
+    def pygame_clock_tick_accumulate_time(self):
+        waited = self.pygame_wait_while_idle()
+        frame_time = self.clock.tick(settings.FPS)
+        if waited:
+            # nothing moved while waiting, there is no backlog of physics steps to catch up on
+            frame_time = min(frame_time, 1000 / settings.FPS)
+        self.physics_time_accumulator += frame_time / 1000.0
 
     def pygame_draw(self):
+        if self.renderer is not None:
+            self.dirty_rects = self.renderer.render(*self.board.sprites(self.shot_hint))
+            self.shot_hint = None
+            return
+
+        if self.shot_hint:
+            self.board.shot_hint_sprite(*self.shot_hint).draw(self.board.screen)
+            self.shot_hint = None
         self.board.draw_objects(self.board.all_objects)
         self.board.draw_goals()
         self.board.show_scoreboard()
@@ -192,23 +406,26 @@ class Game:
 
     def pygame_update(self):
         self.update()
-        pygame.display.flip()
+        self.count_idle_frames()
+        if self.renderer is not None:
+            pygame.display.update(self.dirty_rects)
+        else:
+            pygame.display.flip()
 
     def play_crowd_clapping_sound(self):
         self.media.crowd_clapping_sound.play()
 
     def winner_ceremony_start(self):
-        self.rules_freezed_for_ceremony_finish_time = pygame.time.get_ticks() + settings.WINNER_CEREMONY_TIME
+        self.rules_freezed_for_ceremony_finish_time = self.clock.get_ticks() + settings.WINNER_CEREMONY_TIME
         self.play_crowd_clapping_sound()
 
     def winner_ceremony_end(self):
-        self.pygame_quit() # TODO
-        exit()
+        self.exit_game()
 
     def check_winner_ceremony_end(self):
         if (self.is_finished and
                 self.rules_freezed_for_ceremony_finish_time and
-                self.rules_freezed_for_ceremony_finish_time <= pygame.time.get_ticks()):
+                self.rules_freezed_for_ceremony_finish_time <= self.clock.get_ticks()):
             self.winner_ceremony_end()
             self.rules_freezed_for_ceremony_finish_time = 0
 
@@ -217,7 +434,7 @@ class Game:
         self.winner_ceremony_start()
 
     def goal_ceremony_start(self):
-        self.rules_freezed_for_ceremony_finish_time = pygame.time.get_ticks() + settings.GOAL_CEREMONY_TIME
+        self.rules_freezed_for_ceremony_finish_time = self.clock.get_ticks() + settings.GOAL_CEREMONY_TIME
         self.play_crowd_clapping_sound()
 
     def goal_ceremony_end(self):
@@ -226,7 +443,7 @@ class Game:
     def check_goal_ceremony_end(self):
         if (not self.is_finished and
                 self.rules_freezed_for_ceremony_finish_time and
-                self.rules_freezed_for_ceremony_finish_time <= pygame.time.get_ticks()):
+                self.rules_freezed_for_ceremony_finish_time <= self.clock.get_ticks()):
             self.goal_ceremony_end()
             self.rules_freezed_for_ceremony_finish_time = 0
 
@@ -256,14 +473,59 @@ class Game:
         self.scored(scored_side)
 
 
+    def get_snapshot_interpolator(self) -> SnapshotInterpolator:
+        if self.snapshot_interpolator is None:
+            # objects are created after the game, friction slows each of them by FRICTION_A * mass per second
+            self.snapshot_interpolator = SnapshotInterpolator(
+                np.array([settings.FRICTION_A * obj.mass for obj in Object.objects_list])
+            )
+        return self.snapshot_interpolator
+
+    def interpolate_opponent_board(self):
+        # the latest board drives the game, the drawn one comes out of the jitter buffer
+        interpolator = self.get_snapshot_interpolator()
+        for board, sent_time, arrival_time in self.socket.poll_board_snapshots():
+            interpolator.push(board, sent_time, arrival_time)
+        sample = interpolator.sample(now_time())
+        if sample is not None:
+            self.board.show_render_positions(*sample)
+
     def show_opponent_board_multiplayer(self):
         board_update = self.socket.get_board_from_opponent()
 
-        self.board.load_board(board_update)
+        if board_update is not None:
+            self.board.load_board(board_update)
+
+        # the board's mouse is the opponent's, our clicks are dropped instead so they do not keep the loop from waiting
+        self.board.mouse.drop_my_clicks()
+
+        self.pygame_refresh_background()
+
+        self.pygame_clock_tick_accumulate_time()
+
+        self.pygame_event_handle()
+
+        self.interpolate_opponent_board()
+
+        self.pygame_draw()
+
+        self.pygame_update()
+
+        self.check_ceremony_end()
+
+        if not self.is_ceremony_running():
+            self.pygame_goal_check()
+
+    def simulate_opponent_turn_multiplayer(self):
+        for event_name, content in self.socket.poll_opponent_events():
+            self.handle_opponent_event(event_name, content)
+
+        # keeps the local clicks from piling up until our turn
+        self.board.mouse.update_my_mouse()
 
         self.pygame_refresh_background()
 
-        self.pygame_clock_tick_set_dt()
+        self.pygame_clock_tick_accumulate_time()
 
         self.pygame_event_handle()
 
@@ -283,7 +545,7 @@ class Game:
 
         self.pygame_refresh_background()
 
-        self.pygame_clock_tick_set_dt()
+        self.pygame_clock_tick_accumulate_time()
 
         self.pygame_event_handle()
 
@@ -298,9 +560,41 @@ class Game:
         if not self.is_ceremony_running():
             self.pygame_goal_check()
 
-        self.socket.send_board_to_opponent(self.board.dump_board())
+        if not self.is_lockstep():
+            # the socket client decides which of these boards are worth sending
+            self.socket.send_board_to_opponent(self.board.dump_packed_board())
+
+    def run_game_authoritative_multiplayer(self):
+        # the server simulates and judges both turns, it only ever gets our shots
+        for event_name, content in self.socket.poll_opponent_events():
+            self.handle_opponent_event(event_name, content)
+
+        board_update = self.socket.get_board_from_opponent()
+
+        if board_update is not None:
+            self.board.load_board(board_update)
+
+        if self.is_remote_shot_turn() and not self.board.is_idle():
+            # the opponent's shot is under way, there is nothing left of its drag to draw
+            self.dragged_player = None
+
+        # after the server's board, which carries no mouse of ours
+        self.board.mouse.update_my_mouse()
+
+        self.pygame_refresh_background()
+
+        self.pygame_clock_tick_accumulate_time()
+
+        self.pygame_event_handle()
+
+        self.interpolate_opponent_board()
+
+        self.pygame_draw()
+
+        self.pygame_update()
+
+        self.check_ceremony_end()
 
-    
     def run_multiplayer_game(self):
         running = True
 
@@ -308,8 +602,12 @@ class Game:
 
         while running:
             
-            if self.turn == self.socket.side:
+            if self.is_authoritative():
+                self.run_game_authoritative_multiplayer()
+            elif self.turn == self.socket.side:
                 self.run_game_in_my_turn_multiplayer()
+            elif self.is_lockstep():
+                self.simulate_opponent_turn_multiplayer()
             else:
                 self.show_opponent_board_multiplayer()
 
@@ -325,10 +623,12 @@ class Game:
 
             self.pygame_refresh_background()
 
-            self.pygame_clock_tick_set_dt()
+            self.pygame_clock_tick_accumulate_time()
 
             self.pygame_event_handle()
 
+            self.play_bot_turn()
+
             self.pygame_draw()
 
             self.pygame_update()
@@ -347,5 +647,7 @@ class Game:
         
 
     def __del__(self):
+        if getattr(self, "bot", None) is not None:
+            self.bot.close()
         self.pygame_quit()
 
@@ -5,16 +5,19 @@ import os
 
 from .Player import GoalKeeper, Striker, Defender
 from .Ball import Ball
+from .TextCache import TextCache
+from .AssetCache import AssetCache, SpriteAtlas
 import settings
 
 class MediaLoader:
 
     def __init__(self):
-        ...
-
-    def play_gif(self, gif: list[pygame.Surface], end_time: int, screen: pygame.Surface):
-        now_time = pygame.time.get_ticks()
+        self.asset_cache: AssetCache | None = None
+        self.sprite_atlas: SpriteAtlas | None = None
+        if settings.ASSET_CACHE:
+            self.asset_cache = AssetCache(os.path.join("assets", "cache"))
 
+    def gif_frame(self, gif: list[pygame.Surface], end_time: int, now_time: int) -> tuple[pygame.Surface, pygame.Rect]:
         frame = ((end_time - now_time)//100)%len(gif)
         middle_of_screen_position = (
             (settings.PITCH_LEFT_BORDER + settings.PITCH_RIGHT_BORDER) // 2,
@@ -22,24 +25,48 @@ class MediaLoader:
         )
         image = gif[frame]
         image_rect = image.get_rect(center=middle_of_screen_position)
+        return image, image_rect
 
-        screen.blit(gif[frame], image_rect)
+    def play_gif(self, gif: list[pygame.Surface], end_time: int, now_time: int, screen: pygame.Surface):
+        image, image_rect = self.gif_frame(gif, end_time, now_time)
 
-    def load_image(self, image_filename, size: tuple[float, float] = None) -> pygame.Surface:
-        image_path = os.path.join("assets", "images", image_filename)
+        screen.blit(image, image_rect)
+
+    def decode_image(self, image_path, size: tuple[float, float] = None) -> pygame.Surface:
         image = pygame.image.load(image_path).convert_alpha()
         if size:
             image = pygame.transform.smoothscale(image, size)
         return image
-    
-    def load_gif(self, gif_filename) -> list[pygame.Surface]:
+
+    def load_image(self, image_filename, size: tuple[float, float] = None) -> pygame.Surface:
+        image_path = os.path.join("assets", "images", image_filename)
+        if self.asset_cache is None:
+            return self.decode_image(image_path, size)
+        return self.asset_cache.load_frames(image_path, size, lambda: [self.decode_image(image_path, size)])[0]
+
+    def load_sprite(self, image_filename, size: tuple[float, float]) -> pygame.Surface:
+        # the small images come out of the atlas, which is only built once all of them are loaded
+        image_path = os.path.join("assets", "images", image_filename)
+        if self.asset_cache is None:
+            return self.decode_image(image_path, size)
+        if self.sprite_atlas is None:
+            self.sprite_atlas = SpriteAtlas(self.asset_cache)
+        return self.sprite_atlas.load(image_path, size, lambda: self.decode_image(image_path, size))
+
+    def decode_gif(self, gif_path) -> list[pygame.Surface]:
         gif = []
-        with Image.open(os.path.join("assets", "gifs", gif_filename)) as img:
+        with Image.open(gif_path) as img:
             for frame in range(1, img.n_frames):
                 img.seek(frame)
                 frame_surface = pygame.image.fromstring(img.tobytes(), img.size, img.mode).convert_alpha()
                 gif.append(frame_surface)
         return gif
+
+    def load_gif(self, gif_filename) -> list[pygame.Surface]:
+        gif_path = os.path.join("assets", "gifs", gif_filename)
+        if self.asset_cache is None:
+            return self.decode_gif(gif_path)
+        return self.asset_cache.load_frames(gif_path, None, lambda: self.decode_gif(gif_path))
     
     def load_sound(self, sound_filename) -> pygame.mixer.Sound:
         return pygame.mixer.Sound(os.path.join("assets", "sounds", sound_filename))
@@ -47,25 +74,25 @@ class MediaLoader:
     def load_goalkeeper_images(self):
         PLAYER_IMAGE_SIZE = (2.5 * GoalKeeper.RADIUS, 2.5 * GoalKeeper.RADIUS)
 
-        self.blue_goalkeeper_image = self.load_image("blue_goalkeeper.png", PLAYER_IMAGE_SIZE)
-        self.blue_goalkeeper_activated_image = self.load_image("blue_goalkeeper_activated.png", PLAYER_IMAGE_SIZE)
-        self.red_goalkeeper_image = self.load_image("red_goalkeeper.png", PLAYER_IMAGE_SIZE)
-        self.red_goalkeeper_activated_image = self.load_image("red_goalkeeper_activated.png", PLAYER_IMAGE_SIZE)
+        self.blue_goalkeeper_image = self.load_sprite("blue_goalkeeper.png", PLAYER_IMAGE_SIZE)
+        self.blue_goalkeeper_activated_image = self.load_sprite("blue_goalkeeper_activated.png", PLAYER_IMAGE_SIZE)
+        self.red_goalkeeper_image = self.load_sprite("red_goalkeeper.png", PLAYER_IMAGE_SIZE)
+        self.red_goalkeeper_activated_image = self.load_sprite("red_goalkeeper_activated.png", PLAYER_IMAGE_SIZE)
 
     def load_defender_images(self):
         PLAYER_IMAGE_SIZE = (2.5 * Defender.RADIUS, 2.5 * Defender.RADIUS)
         
-        self.blue_defender_image = self.load_image("blue_defender.png", PLAYER_IMAGE_SIZE)
-        self.blue_defender_activated_image = self.load_image("blue_defender_activated.png", PLAYER_IMAGE_SIZE)
-        self.red_defender_image = self.load_image("red_defender.png", PLAYER_IMAGE_SIZE)
-        self.red_defender_activated_image = self.load_image("red_defender_activated.png", PLAYER_IMAGE_SIZE)
+        self.blue_defender_image = self.load_sprite("blue_defender.png", PLAYER_IMAGE_SIZE)
+        self.blue_defender_activated_image = self.load_sprite("blue_defender_activated.png", PLAYER_IMAGE_SIZE)
+        self.red_defender_image = self.load_sprite("red_defender.png", PLAYER_IMAGE_SIZE)
+        self.red_defender_activated_image = self.load_sprite("red_defender_activated.png", PLAYER_IMAGE_SIZE)
 
     def load_striker_images(self):
         PLAYER_IMAGE_SIZE = (2.5 * Striker.RADIUS, 2.5 * Striker.RADIUS)
-        self.blue_striker_image = self.load_image("blue_striker.png", PLAYER_IMAGE_SIZE)
-        self.blue_striker_activated_image = self.load_image("blue_striker_activated.png", PLAYER_IMAGE_SIZE)
-        self.red_striker_image = self.load_image("red_striker.png", PLAYER_IMAGE_SIZE)
-        self.red_striker_activated_image = self.load_image("red_striker_activated.png", PLAYER_IMAGE_SIZE)
+        self.blue_striker_image = self.load_sprite("blue_striker.png", PLAYER_IMAGE_SIZE)
+        self.blue_striker_activated_image = self.load_sprite("blue_striker_activated.png", PLAYER_IMAGE_SIZE)
+        self.red_striker_image = self.load_sprite("red_striker.png", PLAYER_IMAGE_SIZE)
+        self.red_striker_activated_image = self.load_sprite("red_striker_activated.png", PLAYER_IMAGE_SIZE)
 
     def load_player_images(self):
         self.load_goalkeeper_images()
@@ -74,7 +101,7 @@ class MediaLoader:
 
     def load_ball_image(self):
         BALL_IMAGE_SIZE = (2 * Ball.RADIUS, 2 * Ball.RADIUS)
-        self.ball_image = self.load_image("ball.png", BALL_IMAGE_SIZE)
+        self.ball_image = self.load_sprite("ball.png", BALL_IMAGE_SIZE)
 
     def load_pitch_image(self):
         PITCH_IMAGE_SIZE = (settings.SCREEN_WIDTH, settings.SCREEN_HEIGHT)
@@ -84,6 +111,8 @@ class MediaLoader:
     def load_images(self):
         self.load_player_images()
         self.load_ball_image()
+        if self.sprite_atlas is not None:
+            self.sprite_atlas.save()
         self.load_pitch_image()
 
     def load_player_sounds(self):
@@ -103,6 +132,7 @@ class MediaLoader:
     def load_fonts(self):
         self.large_font = pygame.font.SysFont('Arial', 48)
         self.font = pygame.font.SysFont('Arial', 30)
+        self.text_cache = TextCache(settings.TEXT_CACHE_SIZE)
         
     def load_gifs(self):
         self.goal_ceremony_gif = self.load_gif("goal_ceremony.gif")
@@ -54,13 +54,52 @@ class MouseModel(BaseModel):
 class BoardUpdate(BaseModel):
     mouse: MouseModel
     objects: list[ObjectModel]
+    is_keyframe: bool = True # False when objects only holds the ones that changed since the previous update
+
+class Shot(BaseModel):
+    object_id: int
+    velocity: Velocity
+
+class CollisionEvent(BaseModel):
+    tick: int
+    first_id: int
+    second_id: int | None = None
+
+    def is_border_collision(self) -> bool:
+        return self.second_id is None
+
+class DragPreview(BaseModel):
+    object_id: int
+    mouse_pos: Position
+
+class TurnEnd(BaseModel):
+    board: BoardUpdate
+    turn: int # Side.value of the side that plays next
+    red_score: int
+    blue_score: int
+
+class WireFormat(Enum):
+    JSON = "json"
+    BINARY = "binary"
+
+class NetworkMode(Enum):
+    STREAM = "stream" # the active player sends the whole board every frame
+    LOCKSTEP = "lockstep" # only shots, drag previews and turn ends are sent, both sides simulate
+    AUTHORITATIVE = "authoritative" # the server simulates every match, players only send shots and drag previews
 
 class User(BaseModel):
     id: int = random.randint(0, 1000000000)
     username: str
+    wire_format: WireFormat = WireFormat.JSON
+    network_mode: NetworkMode = NetworkMode.STREAM
+    rating: int = 1000
 
 class MatchRequest(BaseModel):
     created_at: float = now_time()
+    rtt: float | None = None # ms, as measured by the client, players are preferably matched with close ones
+
+class Spectate(BaseModel):
+    username: str # of one of the players of the live match to watch
 
 class Match(BaseModel):
     id: int = random.randint(0, 1000000000)
@@ -75,12 +114,22 @@ class Match(BaseModel):
             return self.left_user
         else:
             return None
+
+    def network_mode(self) -> NetworkMode:
+        if self.left_user.network_mode == self.right_user.network_mode:
+            return self.left_user.network_mode
+        return NetworkMode.STREAM
         
+# the binary protocol numbers events in this order, only ever append to it
 EVENTS = {
     "user_registeration": User,
     "match_request": MatchRequest,
     "match_start": Match,
-    "board_update": BoardUpdate
+    "board_update": BoardUpdate,
+    "shot": Shot,
+    "drag_preview": DragPreview,
+    "turn_end": TurnEnd,
+    "spectate": Spectate,
 }
 
 def dump_event(model: BaseModel) -> str:
@@ -88,7 +137,7 @@ def dump_event(model: BaseModel) -> str:
     data = json.dumps(
         {
             "event": event_name, 
-            "content": json.loads(model.model_dump_json()),
+            "content": model.model_dump(mode="json"),
             "timestamp": now_time()
         }
     )
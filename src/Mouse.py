@@ -24,6 +24,9 @@ class Mouse:
         ls = pygame.event.get(pygame.MOUSEBUTTONUP)
         return bool(ls)
 
+    def drop_my_clicks(self):
+        pygame.event.get((pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP))
+
     def is_my_mouse_click_hold(self) -> bool:
         ls = pygame.mouse.get_pressed()
         return bool(ls[0])
@@ -8,6 +8,7 @@ from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from .Game import Game
+    from .Physics import PhysicsEngine
 
 class Object:
     count_objects = 0
@@ -18,12 +19,50 @@ class Object:
         Object.objects_list.append(self)
 
         self.game = game
+        self.physics: PhysicsEngine | None = None
+        self.physics_slot: int | None = None
         self.mass = mass
         self.radius = radius
         self.pos = pos
         self.velocity = velocity.astype(np.longdouble)
         self._updated_velocity = velocity.copy()
 
+    @property
+    def pos(self) -> np.ndarray:
+        return self._pos
+
+    @pos.setter
+    def pos(self, value: np.ndarray):
+        if self.physics is None:
+            self._pos = value
+        else:
+            self._pos[:] = value
+
+    @property
+    def velocity(self) -> np.ndarray:
+        return self._velocity
+
+    @velocity.setter
+    def velocity(self, value: np.ndarray):
+        if self.physics is None:
+            self._velocity = value
+        else:
+            self._velocity[:] = value
+            self.physics.velocity_changed()
+
+    @property
+    def render_pos(self) -> np.ndarray:
+        if self.physics is None:
+            return self.pos
+        return self.physics.render_pos[self.physics_slot]
+
+    def bind_physics(self, physics: 'PhysicsEngine', slot: int):
+        # from now on pos and velocity are views into the engine arrays
+        self.physics = physics
+        self.physics_slot = slot
+        self._pos = physics.pos[slot]
+        self._velocity = physics.velocity[slot]
+
     def is_in_left_goal(self) -> bool:
         return (
             settings.GOAL_UP_BORDER <= self.pos[1] - self.radius and
@@ -180,14 +219,22 @@ class Object:
 
 
     def update_pos(self):
-        self.pos += (self.velocity * self.game.DT).astype('int64')
+        # integrated in float like PhysicsEngine.step, truncating would stop every slow object
+        self.pos = self.pos + self.velocity * self.game.DT
 
         self.fit_new_pos_in_the_board()
         
         self.fit_new_pos_without_collision()
 
         
-    def draw(self, screen: pygame.Surface): ...
+    def get_image(self) -> pygame.Surface: ...
+
+    def get_image_rect(self, image: pygame.Surface) -> pygame.Rect:
+        return image.get_rect(center=tuple(self.render_pos))
+
+    def draw(self, screen: pygame.Surface):
+        image = self.get_image()
+        screen.blit(image, self.get_image_rect(image).topleft)
 
     def load_object(self, obj_model: ObjectModel):
         self.pos = obj_model.pos.to_ndarray()
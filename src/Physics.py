@@ -0,0 +1,335 @@
+import numpy as np
+
+import settings
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .Object import Object
+
+NO_SLOTS = np.zeros((0), dtype=np.intp)
+NO_SLOTS.flags.writeable = False
+
+
+class PhysicsEngine:
+
+    def __init__(self):
+        self.ids = np.zeros((0), dtype=np.intp)
+        self.pos = np.zeros((0, 2), dtype=np.float64)
+        self.previous_pos = np.zeros((0, 2), dtype=np.float64)
+        self.render_pos = np.zeros((0, 2), dtype=np.float64)
+        self.velocity = np.zeros((0, 2), dtype=np.float64)
+        self.mass = np.zeros((0), dtype=np.float64)
+        self.radius = np.zeros((0), dtype=np.float64)
+        self._candidates_first = np.zeros((0), dtype=np.intp)
+        self._candidates_second = np.zeros((0), dtype=np.intp)
+        self._candidates_margin = np.zeros((0), dtype=np.float64)
+        self._candidates_reach_squared = np.zeros((0), dtype=np.float64)
+        self._is_idle: bool | None = None
+
+    @property
+    def is_bound(self) -> bool:
+        return self.count > 0
+
+    @property
+    def count(self) -> int:
+        return len(self.mass)
+
+    def load_bodies(self, ids, pos, velocity, mass, radius):
+        self.ids = np.array(ids, dtype=np.intp)
+        self.pos = np.array(pos, dtype=np.float64).reshape(-1, 2)
+        self.velocity = np.array(velocity, dtype=np.float64).reshape(-1, 2)
+        self.mass = np.array(mass, dtype=np.float64)
+        self.radius = np.array(radius, dtype=np.float64)
+        self.previous_pos = self.pos.copy()
+        self.render_pos = self.pos.copy()
+        self._candidates_margin = np.zeros_like(self.radius)
+        self._is_idle = None
+        self.allocate_step_buffers()
+        if not self.uses_broad_phase():
+            self.set_candidate_pairs(*self.static_candidate_pairs())
+
+        # board limits for each object's center, the radius is already taken into account
+        r = self.radius
+        self._goal_mouth_y = (settings.GOAL_UP_BORDER + r, settings.GOAL_DOWN_BORDER - r)
+        self._goal_x = (settings.GOAL_LEFT_BORDER + r, settings.GOAL_RIGHT_BORDER - r)
+        self._pitch_x = (settings.PITCH_LEFT_BORDER + r, settings.PITCH_RIGHT_BORDER - r)
+        self._pitch_y = (settings.PITCH_UP_BORDER + r, settings.PITCH_DOWN_BORDER - r)
+
+    def allocate_step_buffers(self):
+        # a tick without contacts writes every intermediate result into these, so stepping allocates nothing
+        count = self.count
+        self._updated_velocity = np.zeros((count, 2), dtype=np.float64)
+        self._displacement = np.zeros((count, 2), dtype=np.float64)
+        self._speed = np.zeros((count), dtype=np.float64)
+        self._friction_scale = np.zeros((count), dtype=np.float64)
+        self._friction_dt = None
+        self._friction_impulse = np.zeros((count), dtype=np.float64)
+        self._limit = np.zeros((count), dtype=np.float64)
+        self._in_goal_mouth = np.zeros((count), dtype=bool)
+        self._mask = np.zeros((count), dtype=bool)
+        self._hit_mask = np.zeros((count), dtype=bool)
+        self._wall_hit_mask = np.zeros((count), dtype=bool)
+
+    def bind_objects(self, objects: list['Object']):
+        # copy every object's state into contiguous arrays, objects become views into them
+        self.load_bodies(
+            ids=[obj.id for obj in objects],
+            pos=[obj.pos for obj in objects],
+            velocity=[obj.velocity for obj in objects],
+            mass=[obj.mass for obj in objects],
+            radius=[obj.radius for obj in objects],
+        )
+        for slot, obj in enumerate(objects):
+            obj.bind_physics(self, slot)
+
+    def copy(self) -> 'PhysicsEngine':
+        engine = PhysicsEngine()
+        engine.load_bodies(self.ids, self.pos, self.velocity, self.mass, self.radius)
+        return engine
+
+    def snap_render_positions(self):
+        self.previous_pos[:] = self.pos
+        self.render_pos[:] = self.pos
+
+    def interpolate_render_positions(self, alpha: float):
+        # draw between the last two physics states, alpha is how far we are into the next step
+        np.subtract(self.pos, self.previous_pos, out=self.render_pos)
+        self.render_pos *= alpha
+        self.render_pos += self.previous_pos
+
+    def velocity_changed(self):
+        # whatever writes velocity outside of step calls this, until then is_idle keeps its last answer
+        self._is_idle = None
+
+    def is_idle(self) -> bool:
+        if self._is_idle is None:
+            self._is_idle = not self.velocity.any()
+        return self._is_idle
+
+    def goal_mouth_mask(self) -> np.ndarray:
+        y = self.pos[:, 1]
+        in_goal_mouth = self._in_goal_mouth
+        np.greater_equal(y, self._goal_mouth_y[0], out=in_goal_mouth)
+        np.less_equal(y, self._goal_mouth_y[1], out=self._mask)
+        return np.logical_and(in_goal_mouth, self._mask, out=in_goal_mouth)
+
+    def outside_limits(self, values: np.ndarray, limits: tuple[np.ndarray, np.ndarray], out: np.ndarray) -> np.ndarray:
+        np.less_equal(values, limits[0], out=out)
+        np.greater_equal(values, limits[1], out=self._mask)
+        return np.logical_or(out, self._mask, out=out)
+
+    def bounce_on_borders(self, updated_velocity: np.ndarray) -> np.ndarray:
+        x, y = self.pos[:, 0], self.pos[:, 1]
+        in_goal_mouth = self.goal_mouth_mask()
+        hit, wall_hit = self._hit_mask, self._wall_hit_mask
+
+        # goal border hits inside the goal mouth and metal border hits outside of it turn the x velocity around,
+        # a > b of two masks is a & ~b
+        self.outside_limits(x, self._goal_x, hit)
+        np.logical_and(hit, in_goal_mouth, out=hit)
+        self.outside_limits(x, self._pitch_x, wall_hit)
+        np.greater(wall_hit, in_goal_mouth, out=wall_hit)
+        np.logical_or(hit, wall_hit, out=hit)
+        np.negative(updated_velocity[:, 0], out=updated_velocity[:, 0], where=hit)
+
+        # metal border hits on y
+        self.outside_limits(y, self._pitch_y, hit)
+        np.greater(hit, in_goal_mouth, out=hit)
+        np.negative(updated_velocity[:, 1], out=updated_velocity[:, 1], where=hit)
+
+        # only the metal borders make a sound, same as Object.check_collision_to_metal_border
+        np.logical_or(wall_hit, hit, out=wall_hit)
+        return np.flatnonzero(wall_hit) if wall_hit.any() else NO_SLOTS
+
+    def contact_normals(self, first: np.ndarray, second: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        delta = self.pos[first] - self.pos[second]
+        distance = np.hypot(delta[:, 0], delta[:, 1])
+        normal = np.zeros_like(delta)
+        nonzero = distance > 0
+        normal[nonzero] = delta[nonzero] / distance[nonzero, None]
+        # coincident centers: same fallback axis as theta = pi/2 in Object.collision_to_object_physical_update
+        normal[~nonzero, 1] = 1
+        return normal, distance
+
+    def travel_per_axis(self, dt: float) -> np.ndarray:
+        return np.max(np.abs(self.velocity), axis=1) * dt
+
+    def sweep_and_prune(self, margin: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # sort the x extents once and only pair objects whose intervals overlap on x and y
+        x, y, reach = self.pos[:, 0], self.pos[:, 1], self.radius + margin
+        order = np.argsort(x - reach, kind='stable')
+        low = (x - reach)[order]
+        high = (x + reach)[order]
+        ends = np.searchsorted(low, high, side='right')
+        counts = np.maximum(ends - np.arange(1, self.count + 1), 0)
+
+        first = np.repeat(np.arange(self.count), counts)
+        run_starts = np.repeat(np.cumsum(counts) - counts, counts)
+        second = first + 1 + np.arange(len(first)) - run_starts
+        first, second = order[first], order[second]
+
+        close_on_y = np.abs(y[first] - y[second]) <= reach[first] + reach[second]
+        return first[close_on_y], second[close_on_y]
+
+    def static_candidate_pairs(self) -> tuple[np.ndarray, np.ndarray]:
+        # few objects: testing every pair is cheaper than sorting them each tick
+        return np.triu_indices(self.count, k=1)
+
+    def uses_broad_phase(self) -> bool:
+        return self.count >= settings.BROAD_PHASE_MIN_OBJECTS
+
+    def set_candidate_pairs(self, first: np.ndarray, second: np.ndarray):
+        self._candidates_first, self._candidates_second = first, second
+        self._candidates_reach_squared = (self.radius[first] + self.radius[second]) ** 2
+        self._pair_delta = np.zeros((len(first), 2), dtype=np.float64)
+        self._pair_second_pos = np.zeros((len(first), 2), dtype=np.float64)
+        self._pair_distance_squared = np.zeros(len(first), dtype=np.float64)
+        self._pair_mask = np.zeros(len(first), dtype=bool)
+
+    def update_candidate_pairs(self, margin: np.ndarray):
+        self.set_candidate_pairs(*self.sweep_and_prune(margin))
+        self._candidates_margin = margin
+
+    def candidates_distance_squared(self) -> np.ndarray:
+        # written into the pair buffers, valid until the next call. the pairs always hold valid slots, and
+        # mode='clip' lets take write straight into them instead of going through a bounds checked copy
+        delta, second_pos = self._pair_delta, self._pair_second_pos
+        np.take(self.pos, self._candidates_first, axis=0, out=delta, mode='clip')
+        np.take(self.pos, self._candidates_second, axis=0, out=second_pos, mode='clip')
+        np.subtract(delta, second_pos, out=delta)
+        np.multiply(delta, delta, out=delta)
+        return np.add(delta[:, 0], delta[:, 1], out=self._pair_distance_squared)
+
+    def find_contacts(self) -> tuple[np.ndarray, np.ndarray]:
+        touching = np.less_equal(self.candidates_distance_squared(), self._candidates_reach_squared, out=self._pair_mask)
+        if not touching.any():
+            return NO_SLOTS, NO_SLOTS
+        return self._candidates_first[touching], self._candidates_second[touching]
+
+    def collision_response(self, updated_velocity: np.ndarray, first: np.ndarray, second: np.ndarray):
+        if not len(first):
+            return
+        normal, _ = self.contact_normals(first, second)
+        v1 = np.einsum('ij,ij->i', self.velocity[first], normal)
+        v2 = np.einsum('ij,ij->i', self.velocity[second], normal)
+        m1, m2 = self.mass[first], self.mass[second]
+        # 1D elastic collision along the normal, tangential components are kept
+        impulse = 2 * (v2 - v1) / (m1 + m2)
+        np.add.at(updated_velocity, first, (m2 * impulse)[:, None] * normal)
+        np.add.at(updated_velocity, second, (-m1 * impulse)[:, None] * normal)
+
+    def stop_slow_objects_and_apply_friction(self, updated_velocity: np.ndarray, dt: float):
+        # objects under the minimum speed stop, the others slow down by FRICTION_A * mass * dt
+        if dt != self._friction_dt:
+            self._friction_impulse = settings.FRICTION_A * dt * self.mass
+            self._friction_dt = dt
+        speed, scale, moving = self._speed, self._friction_scale, self._mask
+        np.hypot(updated_velocity[:, 0], updated_velocity[:, 1], out=speed)
+        np.greater_equal(speed, settings.MINIMUM_OF_VELOCITY_TO_STOPPING_OBJECT, out=moving)
+        scale.fill(0)
+        np.divide(self._friction_impulse, speed, out=scale, where=moving)
+        np.subtract(1, scale, out=scale, where=moving)
+        updated_velocity *= scale[:, None]
+
+    def fit_positions_in_the_board(self):
+        x, y = self.pos[:, 0], self.pos[:, 1]
+        in_goal_mouth = self.goal_mouth_mask()
+        limit = self._limit
+        for limits, clamp in ((0, np.maximum), (1, np.minimum)):
+            np.copyto(limit, self._pitch_x[limits])
+            np.copyto(limit, self._goal_x[limits], where=in_goal_mouth)
+            clamp(x, limit, out=x)
+        np.maximum(y, self._pitch_y[0], out=y)
+        np.minimum(y, self._pitch_y[1], out=y)
+
+    def separate_overlapping_objects(self):
+        if not len(self._candidates_first):
+            return
+        overlapping = np.less(self.candidates_distance_squared(), self._candidates_reach_squared, out=self._pair_mask)
+        if not overlapping.any():
+            return
+        first, second = self._candidates_first[overlapping], self._candidates_second[overlapping]
+        normal, distance = self.contact_normals(first, second)
+        overlap = self.radius[first] + self.radius[second] - distance
+        push = (overlap / 2)[:, None] * normal
+        np.add.at(self.pos, first, push)
+        np.add.at(self.pos, second, -push)
+
+    def step(self, dt: float) -> tuple[np.ndarray, tuple[np.ndarray, np.ndarray]]:
+        self.previous_pos[:] = self.pos
+
+        # candidate pairs are padded with each object's travel so they also cover the positions after moving
+        if self.uses_broad_phase():
+            self.update_candidate_pairs(settings.BROAD_PHASE_MARGIN_FACTOR * self.travel_per_axis(dt))
+
+        updated_velocity = self._updated_velocity
+        np.copyto(updated_velocity, self.velocity)
+        wall_hits = self.bounce_on_borders(updated_velocity)
+        contacts = self.find_contacts()
+        self.collision_response(updated_velocity, *contacts)
+        self.stop_slow_objects_and_apply_friction(updated_velocity, dt)
+        self.velocity[:] = updated_velocity
+        self._is_idle = None
+
+        self.pos += np.multiply(self.velocity, dt, out=self._displacement)
+        self.fit_positions_in_the_board()
+        if self.uses_broad_phase() and (self.travel_per_axis(dt) > self._candidates_margin).any():
+            self.update_candidate_pairs(np.zeros_like(self.radius))
+        self.separate_overlapping_objects()
+
+        return wall_hits, contacts
+
+
+class BatchPhysicsEngine(PhysicsEngine):
+    # batch_size independent copies of one board stacked in the same arrays, body b * bodies_per_board + i
+    # of the batch is body i of board b, and objects only ever collide with objects of their own board
+
+    def __init__(self, engine: PhysicsEngine, batch_size: int):
+        super().__init__()
+        self.batch_size = batch_size
+        self.bodies_per_board = engine.count
+        self.load_bodies(
+            ids=np.tile(engine.ids, batch_size),
+            pos=np.tile(engine.pos, (batch_size, 1)),
+            velocity=np.tile(engine.velocity, (batch_size, 1)),
+            mass=np.tile(engine.mass, batch_size),
+            radius=np.tile(engine.radius, batch_size),
+        )
+
+    def uses_broad_phase(self) -> bool:
+        return False
+
+    def static_candidate_pairs(self) -> tuple[np.ndarray, np.ndarray]:
+        first, second = np.triu_indices(self.bodies_per_board, k=1)
+        offsets = np.arange(self.batch_size)[:, None] * self.bodies_per_board
+        return (first + offsets).ravel(), (second + offsets).ravel()
+
+    def slots(self, board_slot: int | np.ndarray) -> np.ndarray:
+        return np.arange(self.batch_size) * self.bodies_per_board + board_slot
+
+    def per_board(self, array: np.ndarray) -> np.ndarray:
+        return array.reshape(self.batch_size, self.bodies_per_board, *array.shape[1:])
+
+    def add_boards(self, engine: PhysicsEngine, count: int = 1):
+        # appends count copies of engine's board after the current ones, which keep their numbers
+        self.batch_size += count
+        self.load_bodies(
+            ids=np.concatenate((self.ids, np.tile(engine.ids, count))),
+            pos=np.concatenate((self.pos, np.tile(engine.pos, (count, 1)))),
+            velocity=np.concatenate((self.velocity, np.tile(engine.velocity, (count, 1)))),
+            mass=np.concatenate((self.mass, np.tile(engine.mass, count))),
+            radius=np.concatenate((self.radius, np.tile(engine.radius, count))),
+        )
+
+    def keep_boards(self, boards: np.ndarray):
+        # drops every other board from the batch, the kept ones are renumbered in the given order
+        kept_slots = self.per_board(np.arange(self.count))[boards].ravel()
+        self.batch_size = len(boards)
+        self.load_bodies(
+            ids=self.ids[kept_slots],
+            pos=self.pos[kept_slots],
+            velocity=self.velocity[kept_slots],
+            mass=self.mass[kept_slots],
+            radius=self.radius[kept_slots],
+        )
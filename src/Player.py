@@ -5,6 +5,7 @@ from typing import TYPE_CHECKING
 from enum import Enum
 
 from .Object import Object
+from .Models import Shot, Velocity
 import settings
 
 
@@ -17,6 +18,8 @@ class Side(Enum):
 
 class Player(Object):
 
+    SHOT_FORCE_BOOSTER = 2.5
+
     def __init__(self, game:'Game', mass:float, radius:float, side: Side, pos: np.ndarray, velocity: np.ndarray):
         super().__init__(game, mass, radius, pos, velocity)
         self.side = side
@@ -25,7 +28,11 @@ class Player(Object):
     def is_activated(self):
         return self.game.turn == self.side and self.game.board.is_idle()
 
-    def draw(self, screen: pygame.Surface):
+    def make_shot(self, dragging_mouse_pos: np.ndarray) -> Shot:
+        velocity = self.SHOT_FORCE_BOOSTER * (self.pos - dragging_mouse_pos)
+        return Shot(object_id=self.id, velocity=Velocity(x=velocity[0], y=velocity[1]))
+
+    def get_image(self) -> pygame.Surface:
         ...
     
     def collision_object_play_sound(self, other=None):
@@ -62,7 +69,7 @@ class GoalKeeper(Player):
         self.pos[1] = min(settings.PENALTY_AREA_DOWN_BORDER-self.radius, self.pos[1])
 
 
-    def draw(self, screen: pygame.Surface):
+    def get_image(self) -> pygame.Surface:
         image = None
         if self.side == Side.BLUE:
             if self.is_activated():
@@ -75,10 +82,7 @@ class GoalKeeper(Player):
             else:
                 image = self.game.media.red_goalkeeper_image
 
-        image_rect = image.get_rect(center=tuple(self.pos))
-        
-
-        screen.blit(image, image_rect.topleft)
+        return image
 
     def __repr__(self) -> str:
         return (f"GoalKeeper(side={self.side}, mass={self.mass}, radius={self.radius}, "
@@ -92,7 +96,7 @@ class Defender(Player):
     def __init__(self, game:'Game', side: Side, pos: np.ndarray, velocity: np.ndarray = np.zeros((2), dtype=np.longdouble)):
         super().__init__(game, Defender.MASS, Defender.RADIUS, side, pos, velocity)
 
-    def draw(self, screen: pygame.Surface):
+    def get_image(self) -> pygame.Surface:
         image = None
         if self.side == Side.BLUE:
             if self.is_activated():
@@ -105,9 +109,7 @@ class Defender(Player):
             else:
                 image = self.game.media.red_defender_image
 
-        image_rect = image.get_rect(center=tuple(self.pos))
-
-        screen.blit(image, image_rect.topleft)
+        return image
 
     def __repr__(self) -> str:
         return (f"Defender(side={self.side}, mass={self.mass}, radius={self.radius}, "
@@ -117,10 +119,11 @@ class Striker(Player):
 
     MASS = 1.5
     RADIUS = 30
+    SHOT_FORCE_BOOSTER = 3.5
     def __init__(self, game:'Game', side: Side, pos: np.ndarray, velocity: np.ndarray=np.zeros((2), dtype=np.longdouble)):
         super().__init__(game, Striker.MASS, Striker.RADIUS, side, pos, velocity)
 
-    def draw(self, screen: pygame.Surface):
+    def get_image(self) -> pygame.Surface:
         image = None
         if self.side == Side.BLUE:
             if self.is_activated():
@@ -133,9 +136,7 @@ class Striker(Player):
             else:
                 image = self.game.media.red_striker_image
 
-        image_rect = image.get_rect(center=tuple(self.pos))
-
-        screen.blit(image, image_rect.topleft)
+        return image
 
     def __repr__(self) -> str:
         return (f"Striker(side={self.side}, mass={self.mass}, radius={self.radius}, "
@@ -0,0 +1,180 @@
+import numpy as np
+import struct
+
+from .Models import (EVENTS, BoardUpdate, MouseModel, MouseStatus, ObjectModel, Position, Velocity,
+                     WireFormat, dump_event, load_event)
+from pydantic import BaseModel
+import settings
+from utils.time import now_time
+
+BINARY_PROTOCOL_VERSION = 1
+# json frames always start with '{', binary frames start with the version byte with its high bit set
+BINARY_FRAME_MARKER = 0x80
+
+FRAME_HEADER = struct.Struct('!BBBd') # version, event type id, flags, timestamp
+FLAG_KEYFRAME = 0x01
+BOARD_HEADER = struct.Struct('!hhBB') # mouse x, mouse y, mouse status, objects count
+OBJECT_RECORD = np.dtype([
+    ("id", ">u1"),
+    ("x", ">i2"),
+    ("y", ">i2"),
+    ("velocity_x", ">f4"),
+    ("velocity_y", ">f4"),
+])
+
+EVENT_NAMES = list(EVENTS)
+EVENT_TYPE_IDS = {event_name: type_id for type_id, event_name in enumerate(EVENT_NAMES)}
+# the server only passes these on to the opponent, so it never has to decode them
+RELAYED_EVENTS = frozenset({"board_update", "shot", "drag_preview", "turn_end"})
+JSON_EVENT_PREFIX = b'{"event": "' # dump_event always writes the event name first
+
+
+class PackedBoardUpdate:
+    # a board_update kept as one numpy record per object, so it never builds a pydantic model per object
+
+    def __init__(self, mouse_pos: tuple[int, int], mouse_status: MouseStatus, objects: np.ndarray,
+                 is_keyframe: bool = True):
+        self.mouse_pos = mouse_pos
+        self.mouse_status = mouse_status
+        self.objects = objects
+        self.is_keyframe = is_keyframe
+
+    @classmethod
+    def from_arrays(cls, mouse_pos, mouse_status: MouseStatus, ids: np.ndarray, pos: np.ndarray,
+                    velocity: np.ndarray) -> 'PackedBoardUpdate':
+        objects = np.empty(len(ids), dtype=OBJECT_RECORD)
+        objects["id"] = ids
+        objects["x"], objects["y"] = pos[:, 0], pos[:, 1]
+        objects["velocity_x"], objects["velocity_y"] = velocity[:, 0], velocity[:, 1]
+        return cls((int(mouse_pos[0]), int(mouse_pos[1])), mouse_status, objects)
+
+    @classmethod
+    def from_board_update(cls, board: BoardUpdate) -> 'PackedBoardUpdate':
+        objects = np.array(
+            [(obj.id, obj.pos.x, obj.pos.y, obj.velocity.x, obj.velocity.y) for obj in board.objects],
+            dtype=OBJECT_RECORD
+        )
+        return cls((board.mouse.pos.x, board.mouse.pos.y), board.mouse.status, objects, board.is_keyframe)
+
+    def to_board_update(self) -> BoardUpdate:
+        objects = [
+            ObjectModel(id=object_id, pos=Position(x=x, y=y), velocity=Velocity(x=velocity_x, y=velocity_y))
+            for object_id, x, y, velocity_x, velocity_y in self.objects.tolist()
+        ]
+        mouse = MouseModel(pos=Position(x=self.mouse_pos[0], y=self.mouse_pos[1]), status=self.mouse_status)
+        return BoardUpdate(mouse=mouse, objects=objects, is_keyframe=self.is_keyframe)
+
+    def dump_payload(self) -> bytes:
+        header = BOARD_HEADER.pack(*self.mouse_pos, self.mouse_status.value, len(self.objects))
+        return header + self.objects.tobytes()
+
+    @classmethod
+    def load_payload(cls, data: bytes, offset: int, is_keyframe: bool = True) -> 'PackedBoardUpdate':
+        mouse_x, mouse_y, mouse_status, count = BOARD_HEADER.unpack_from(data, offset)
+        # copied, the frame may live in a receive buffer that is reused by the next read
+        objects = np.frombuffer(data, dtype=OBJECT_RECORD, count=count, offset=offset + BOARD_HEADER.size).copy()
+        return cls((mouse_x, mouse_y), MouseStatus(mouse_status), objects, is_keyframe)
+
+
+class BoardDeltaEncoder:
+    # tcp delivers every update in order, so the last sent board is the one the opponent has
+
+    def __init__(self, keyframe_interval: int = settings.BOARD_KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.baseline: np.ndarray | None = None
+        self.updates_since_keyframe = 0
+
+    def reset(self):
+        # the next update is a keyframe
+        self.baseline = None
+
+    def encode(self, board: PackedBoardUpdate) -> PackedBoardUpdate:
+        # changes are looked for in the quantized records, so sub-pixel moves of a slow object are not resent
+        objects = board.objects
+        self.updates_since_keyframe += 1
+        if (self.baseline is None or self.updates_since_keyframe >= self.keyframe_interval
+                or len(self.baseline) != len(objects) or (self.baseline["id"] != objects["id"]).any()):
+            self.baseline = objects.copy()
+            self.updates_since_keyframe = 0
+            return PackedBoardUpdate(board.mouse_pos, board.mouse_status, objects, is_keyframe=True)
+
+        changed = objects != self.baseline
+        self.baseline[changed] = objects[changed]
+        return PackedBoardUpdate(board.mouse_pos, board.mouse_status, objects[changed], is_keyframe=False)
+
+
+class BoardDeltaDecoder:
+    # rebuilds the full board from a keyframe and the deltas that followed it
+
+    def __init__(self):
+        self.objects: np.ndarray | None = None
+        self.rows: dict[int, int] = dict()
+
+    def decode(self, board: PackedBoardUpdate) -> PackedBoardUpdate:
+        if board.is_keyframe or self.objects is None:
+            self.objects = board.objects.copy()
+            self.rows = {object_id: row for row, object_id in enumerate(self.objects["id"].tolist())}
+        elif len(board.objects):
+            self.objects[[self.rows[object_id] for object_id in board.objects["id"].tolist()]] = board.objects
+        return PackedBoardUpdate(board.mouse_pos, board.mouse_status, self.objects.copy())
+
+
+def event_name_of(model: BaseModel | PackedBoardUpdate) -> str:
+    if isinstance(model, PackedBoardUpdate):
+        return "board_update"
+    return [key for key, value in EVENTS.items() if isinstance(model, value)][0]
+
+
+def is_binary_frame(data: bytes) -> bool:
+    return bool(data) and bool(data[0] & BINARY_FRAME_MARKER)
+
+
+def peek_event_name(data: bytes | memoryview) -> str | None:
+    # the event name of a frame without decoding it, None when it can not be told from the first bytes
+    if is_binary_frame(data):
+        return EVENT_NAMES[data[1]] if len(data) > 1 and data[1] < len(EVENT_NAMES) else None
+    head = bytes(data[:len(JSON_EVENT_PREFIX) + 32])
+    if not head.startswith(JSON_EVENT_PREFIX):
+        return None
+    end = head.find(b'"', len(JSON_EVENT_PREFIX))
+    return head[len(JSON_EVENT_PREFIX):end].decode('utf-8') if end != -1 else None
+
+
+def dump_binary_event(model: BaseModel | PackedBoardUpdate, flags: int = 0) -> bytes:
+    event_name = event_name_of(model)
+    if isinstance(model, BoardUpdate):
+        model = PackedBoardUpdate.from_board_update(model)
+    if isinstance(model, PackedBoardUpdate) and model.is_keyframe:
+        flags |= FLAG_KEYFRAME
+    header = FRAME_HEADER.pack(BINARY_FRAME_MARKER | BINARY_PROTOCOL_VERSION, EVENT_TYPE_IDS[event_name], flags, now_time())
+    if isinstance(model, PackedBoardUpdate):
+        return header + model.dump_payload()
+    # rare control events keep their json body
+    return header + model.model_dump_json().encode('utf-8')
+
+
+def load_binary_event(data: bytes) -> dict[str, str | BaseModel | PackedBoardUpdate | float]:
+    version, type_id, flags, timestamp = FRAME_HEADER.unpack_from(data)
+    if version & ~BINARY_FRAME_MARKER != BINARY_PROTOCOL_VERSION:
+        raise Exception(f"Unsupported binary protocol version: {version & ~BINARY_FRAME_MARKER}")
+    event_name = EVENT_NAMES[type_id]
+    model = EVENTS[event_name]
+    if model is BoardUpdate:
+        content = PackedBoardUpdate.load_payload(data, FRAME_HEADER.size, bool(flags & FLAG_KEYFRAME))
+    else:
+        content = model.model_validate_json(bytes(data[FRAME_HEADER.size:]))
+    return {"event": event_name, "content": content, "timestamp": timestamp, "flags": flags}
+
+
+def encode_event(model: BaseModel | PackedBoardUpdate, wire_format: WireFormat) -> bytes:
+    if wire_format == WireFormat.BINARY:
+        return dump_binary_event(model)
+    if isinstance(model, PackedBoardUpdate):
+        model = model.to_board_update()
+    return dump_event(model).encode('utf-8')
+
+
+def decode_event(data: bytes | memoryview) -> dict[str, str | BaseModel | PackedBoardUpdate | float]:
+    if is_binary_frame(data):
+        return load_binary_event(data)
+    return load_event(bytes(data))
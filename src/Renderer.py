@@ -0,0 +1,90 @@
+import pygame
+from typing import Callable, Hashable
+
+
+class Sprite:
+    # anything drawn over the pitch, it is redrawn when its rect or state differs from the last frame
+
+    def __init__(self, key: Hashable, rect: pygame.Rect, state: Hashable, draw: Callable[[pygame.Surface], None]):
+        self.key = key
+        self.rect = rect
+        self.state = state
+        self.draw = draw
+
+    @classmethod
+    def from_surface(cls, key: Hashable, surface: pygame.Surface, rect: pygame.Rect, state: Hashable = None) -> 'Sprite':
+        # a surface that is rendered again every frame has to be given a state, like its text
+        state = id(surface) if state is None else state
+        return cls(key, rect, state, lambda screen: screen.blit(surface, rect))
+
+
+class DirtyRectRenderer:
+    # only the regions where a sprite moved, appeared, disappeared or changed are rebuilt from the cached
+    # background and pushed to the display, a frame where nothing changed draws nothing
+
+    def __init__(self, screen: pygame.Surface, background: pygame.Surface, overlay: pygame.Surface | None = None):
+        self.screen = screen
+        self.background = background.convert()
+        self.overlay = overlay # drawn over the sprites below it and under the ones above it, like the goal nets
+        self.drawn: dict[Hashable, tuple[pygame.Rect, Hashable]] = dict()
+        self.needs_full_redraw = True
+
+    def invalidate(self):
+        self.needs_full_redraw = True
+
+    def dirty_rects(self, sprites: list[Sprite]) -> list[pygame.Rect]:
+        if self.needs_full_redraw:
+            self.needs_full_redraw = False
+            return [self.screen.get_rect()]
+
+        rects = []
+        current = {sprite.key: sprite for sprite in sprites}
+        for key, (rect, state) in self.drawn.items():
+            sprite = current.get(key)
+            if sprite is None:
+                rects.append(rect)
+            elif sprite.rect != rect or sprite.state != state:
+                rects.append(rect)
+                rects.append(sprite.rect)
+        for sprite in sprites:
+            if sprite.key not in self.drawn:
+                rects.append(sprite.rect)
+        return self.merge(rects)
+
+    def merge(self, rects: list[pygame.Rect]) -> list[pygame.Rect]:
+        # overlapping rects are joined so no region is redrawn twice, the old and the new place of a moving
+        # sprite mostly overlap and end up as one rect
+        screen_rect = self.screen.get_rect()
+        merged: list[pygame.Rect] = []
+        for rect in rects:
+            rect = rect.clip(screen_rect)
+            if not rect.width or not rect.height:
+                continue
+            index = rect.collidelist(merged)
+            while index != -1:
+                rect.union_ip(merged.pop(index))
+                index = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
+
+    def redraw(self, rect: pygame.Rect, below: list[Sprite], above: list[Sprite]):
+        self.screen.set_clip(rect)
+        self.screen.blit(self.background, rect, rect)
+        for sprite in below:
+            if sprite.rect.colliderect(rect):
+                sprite.draw(self.screen)
+        if self.overlay is not None:
+            self.screen.blit(self.overlay, rect, rect)
+        for sprite in above:
+            if sprite.rect.colliderect(rect):
+                sprite.draw(self.screen)
+        self.screen.set_clip(None)
+
+    def render(self, below: list[Sprite], above: list[Sprite]) -> list[pygame.Rect]:
+        # draws the frame and returns the rects that have to be updated on the display
+        sprites = below + above
+        rects = self.dirty_rects(sprites)
+        for rect in rects:
+            self.redraw(rect, below, above)
+        self.drawn = {sprite.key: (sprite.rect, sprite.state) for sprite in sprites}
+        return rects
@@ -0,0 +1,81 @@
+import numpy as np
+
+from .Models import MouseStatus
+from .Protocol import PackedBoardUpdate
+import settings
+
+
+class SendRateController:
+    # decides which of the boards rendered every frame are worth sending, and counts what went out
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.last_sent_time: float | None = None
+        self.last_sent_mouse: tuple[tuple[int, int], MouseStatus] | None = None
+        self.last_sent_was_idle = False
+        self.backoff = 1.0
+
+        self.messages_sent = 0
+        self.boards_sent = 0
+        self.heartbeats_sent = 0
+        self.boards_skipped = 0
+        self.backoffs = 0
+
+    def send_interval(self, speed: float) -> float:
+        # fast objects are sent often, slow ones can be left to the opponent's interpolation
+        fastest, slowest = settings.BOARD_SEND_INTERVAL_RANGE
+        interval = slowest - (slowest - fastest) * min(speed / settings.BOARD_SEND_FAST_SPEED, 1.0)
+        return interval * self.backoff / 1000
+
+    def should_send(self, board: PackedBoardUpdate, now: float) -> bool:
+        objects = board.objects
+        speed = float(np.hypot(objects["velocity_x"], objects["velocity_y"]).max()) if len(objects) else 0.0
+        return self.should_send_motion(speed, (board.mouse_pos, board.mouse_status), now)
+
+    def should_send_motion(self, speed: float, mouse: tuple[tuple[int, int], MouseStatus], now: float) -> bool:
+        # speed is the one of the fastest object, so a board does not have to be built to be skipped
+        if mouse[1] in (MouseStatus.CLICK_DOWN, MouseStatus.CLICK_UP) or self.last_sent_time is None:
+            return self.sent(speed, mouse, now)
+
+        since_last = now - self.last_sent_time
+        is_idle = speed == 0
+        if is_idle and self.last_sent_was_idle and mouse == self.last_sent_mouse:
+            # nothing changed since the last board, only a heartbeat now and then keeps the opponent sure of it
+            if since_last >= settings.BOARD_HEARTBEAT_INTERVAL / 1000:
+                self.heartbeats_sent += 1
+                return self.sent(speed, mouse, now)
+        elif since_last >= self.send_interval(speed):
+            return self.sent(speed, mouse, now)
+
+        self.boards_skipped += 1
+        return False
+
+    def sent(self, speed: float, mouse: tuple[tuple[int, int], MouseStatus], now: float) -> bool:
+        self.last_sent_time = now
+        self.last_sent_mouse = mouse
+        self.last_sent_was_idle = speed == 0
+        self.boards_sent += 1
+        # the socket kept up, so the rate creeps back up to normal
+        self.backoff = max(1.0, self.backoff * settings.BOARD_SEND_BACKOFF_RECOVERY)
+        return True
+
+    def back_off(self):
+        # the previous board was still waiting for the socket, whose send buffer must be full
+        self.backoffs += 1
+        self.backoff = min(self.backoff * 2, settings.BOARD_SEND_MAX_BACKOFF)
+
+    def message_sent(self):
+        self.messages_sent += 1
+
+    def stats(self, now: float) -> dict[str, float]:
+        duration = max(now - self.started_at, 1e-9)
+        return {
+            "messages_sent": self.messages_sent,
+            "messages_per_second": self.messages_sent / duration,
+            "boards_sent": self.boards_sent,
+            "boards_per_second": self.boards_sent / duration,
+            "heartbeats_sent": self.heartbeats_sent,
+            "boards_skipped": self.boards_skipped,
+            "backoffs": self.backoffs,
+            "backoff": self.backoff,
+        }
@@ -0,0 +1,110 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+
+from .Physics import BatchPhysicsEngine
+from .Simulation import Simulation, scored_side_values
+import settings
+
+
+def shot_table_dtype(bodies_per_board: int) -> np.dtype:
+    return np.dtype([
+        ("object_id", np.intp),
+        ("angle", np.float64),
+        ("power", np.float64),
+        ("scored_side", np.int8), # Side.value, 0 when nobody scored
+        ("ticks", np.int32),
+        ("is_cut_off", np.bool_), # still moving when the deadline came, its final position is not known
+        ("pos", np.float64, (bodies_per_board, 2)), # final positions in the simulation's slot order
+    ])
+
+
+def simulate_shots_batch(simulation: Simulation, object_ids: np.ndarray, angles: np.ndarray, powers: np.ndarray,
+                         dt: float = settings.PHYSICS_TIMESTEP,
+                         max_ticks: int = settings.SHOT_EVALUATOR_MAX_TICKS, deadline: float | None = None) -> np.ndarray:
+    # every shot gets its own copy of the board and all of them are stepped together as one engine
+    batch_size = len(object_ids)
+    engine = BatchPhysicsEngine(simulation.physics, batch_size)
+    table = np.zeros(batch_size, dtype=shot_table_dtype(engine.bodies_per_board))
+    table["object_id"], table["angle"], table["power"] = object_ids, angles, powers
+    if not batch_size:
+        return table
+
+    shooter_slots = np.array([simulation.slots[int(object_id)] for object_id in object_ids])
+    speed = simulation.shot_boosters[shooter_slots] * powers
+    shooters = engine.slots(shooter_slots)
+    engine.velocity[shooters, 0] = speed * np.cos(angles)
+    engine.velocity[shooters, 1] = speed * np.sin(angles)
+    engine.velocity_changed()
+
+    scored_side = table["scored_side"]
+    ticks = table["ticks"]
+    active = np.arange(batch_size) # table row of every board still in the engine
+
+    for _ in range(max_ticks):
+        moving = engine.per_board(engine.velocity).any(axis=(1, 2))
+        if not moving.all():
+            # settled boards are written out and dropped, so later ticks only pay for the moving ones
+            table["pos"][active[~moving]] = engine.per_board(engine.pos)[~moving]
+            active = active[moving]
+            if not len(active):
+                break
+            engine.keep_boards(np.flatnonzero(moving))
+        if deadline is not None and time.perf_counter() >= deadline:
+            table["is_cut_off"][active] = True
+            break
+        ticks[active] += 1
+        engine.step(dt)
+
+        balls = engine.slots(simulation.ball_slot)
+        scored = scored_side_values(engine.pos[balls], engine.radius[balls])
+        newly_scored = scored != 0
+        if newly_scored.any():
+            scored_side[active[newly_scored]] = scored[newly_scored]
+            # like the live game, a board freezes where the goal was scored
+            engine.per_board(engine.velocity)[newly_scored] = 0
+
+    if len(active):
+        table["pos"][active] = engine.per_board(engine.pos)
+    return table
+
+
+class ShotEvaluator:
+
+    def __init__(self, workers: int | None = None, batch_size: int = settings.SHOT_EVALUATOR_BATCH_SIZE):
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.batch_size = batch_size
+        self._executor: ProcessPoolExecutor | None = None
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def evaluate(self, simulation: Simulation, object_ids, angles, powers) -> np.ndarray:
+        object_ids = np.asarray(object_ids, dtype=np.intp)
+        angles = np.asarray(angles, dtype=np.float64)
+        powers = np.asarray(powers, dtype=np.float64)
+
+        if self.workers <= 1 or len(object_ids) <= self.batch_size:
+            return simulate_shots_batch(simulation, object_ids, angles, powers)
+
+        futures = [
+            self.get_executor().submit(
+                simulate_shots_batch, simulation,
+                object_ids[start:start + self.batch_size],
+                angles[start:start + self.batch_size],
+                powers[start:start + self.batch_size],
+            )
+            for start in range(0, len(object_ids), self.batch_size)
+        ]
+        return np.concatenate([future.result() for future in futures])
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,188 @@
+import numpy as np
+from pydantic import BaseModel
+
+from .Physics import PhysicsEngine
+from .Player import Player, Side, GoalKeeper, Defender, Striker
+from .Ball import Ball
+from .Models import BoardUpdate, CollisionEvent, MouseModel, MouseStatus, ObjectModel, Position, Velocity, Shot
+from .Protocol import PackedBoardUpdate
+import settings
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .Board import Board
+
+
+def scored_side_values(ball_pos: np.ndarray, ball_radius: np.ndarray) -> np.ndarray:
+    # Side.value of the side that scored for every ball position, 0 when the ball is not completely in a goal
+    x, y, r = ball_pos[..., 0], ball_pos[..., 1], ball_radius
+    in_goal_mouth = (settings.GOAL_UP_BORDER <= y - r) & (y + r <= settings.GOAL_DOWN_BORDER)
+    scored_side = np.where(in_goal_mouth & (x + r <= settings.PITCH_LEFT_BORDER), Side.BLUE.value, 0)
+    return np.where(in_goal_mouth & (x - r > settings.PITCH_RIGHT_BORDER), Side.RED.value, scored_side)
+
+
+def put_players_in_place(pos: np.ndarray, radius: np.ndarray, sides: np.ndarray, goalkeepers: np.ndarray):
+    # Player.put_player_out_of_the_goal then GoalKeeper.keep_goalkeeper_in_penalty_area for every slot at once
+    x, y = pos[:, 0], pos[:, 1]
+    in_goal_mouth = (settings.GOAL_UP_BORDER <= y - radius) & (y + radius <= settings.GOAL_DOWN_BORDER) & (sides != 0)
+    in_left_goal = in_goal_mouth & (x - radius < settings.PITCH_LEFT_BORDER)
+    in_right_goal = in_goal_mouth & ~in_left_goal & (x + radius > settings.PITCH_RIGHT_BORDER)
+    x[in_left_goal] = settings.PITCH_LEFT_BORDER + radius[in_left_goal] + 1
+    x[in_right_goal] = settings.PITCH_RIGHT_BORDER - radius[in_right_goal] - 1
+
+    red, blue = goalkeepers & (sides == Side.RED.value), goalkeepers & (sides == Side.BLUE.value)
+    x[red] = np.minimum(x[red], settings.LEFTSIDE_PENALTY_AREA_RIGHT_BORDER)
+    x[blue] = np.maximum(x[blue], settings.RIGHTSIDE_PENALTY_AREA_LEFT_BORDER)
+    r = radius[goalkeepers]
+    y[goalkeepers] = np.minimum(np.maximum(y[goalkeepers], settings.PENALTY_AREA_UP_BORDER + r),
+                                settings.PENALTY_AREA_DOWN_BORDER - r)
+
+
+class ShotOutcome(BaseModel):
+    board: BoardUpdate
+    scored_side: Side | None = None
+    collisions: list[CollisionEvent] = []
+    ticks: int = 0
+
+
+class Simulation:
+
+    def __init__(self, physics: PhysicsEngine, sides: np.ndarray, goalkeepers: np.ndarray,
+                 shot_boosters: np.ndarray, ball_slot: int):
+        self.physics = physics
+        self.sides = sides # Side.value of every slot, 0 for the ball
+        self.goalkeepers = goalkeepers
+        self.shot_boosters = shot_boosters
+        self.ball_slot = ball_slot
+        self.ticks = 0
+        self.slots: dict[int, int] = {int(object_id): slot for slot, object_id in enumerate(physics.ids)}
+        self.slot_of_id = np.zeros(int(physics.ids.max()) + 1 if len(physics.ids) else 0, dtype=np.intp)
+        self.slot_of_id[physics.ids] = np.arange(len(physics.ids))
+
+    @classmethod
+    def from_board(cls, board: 'Board') -> 'Simulation':
+        # shares the board's engine, so stepping the simulation moves the drawn objects
+        objects = board.all_objects
+        sides = np.array([obj.side.value if isinstance(obj, Player) else 0 for obj in objects])
+        goalkeepers = np.array([isinstance(obj, GoalKeeper) for obj in objects])
+        shot_boosters = np.array([getattr(obj, "SHOT_FORCE_BOOSTER", 0) for obj in objects])
+        return cls(board.physics, sides, goalkeepers, shot_boosters, objects.index(board.ball))
+
+    @classmethod
+    def create_initial(cls) -> 'Simulation':
+        # same creation order as Board.init_objects, so object ids match the ones of a live game
+        middle_of_screen_position = (
+            (settings.PITCH_LEFT_BORDER + settings.PITCH_RIGHT_BORDER) // 2,
+            (settings.PITCH_UP_BORDER + settings.PITCH_DOWN_BORDER) // 2
+        )
+        bodies = [(Ball, 0, middle_of_screen_position)]
+        for side, coordinates in ((Side.RED, settings.LEFT_SIDE_COORDINATES), (Side.BLUE, settings.RIGHT_SIDE_COORDINATES)):
+            bodies.append((GoalKeeper, side.value, coordinates["goalkeeper"]))
+            bodies += [(Defender, side.value, cor) for cor in coordinates["defenders"]]
+            bodies += [(Striker, side.value, cor) for cor in coordinates["strikers"]]
+
+        physics = PhysicsEngine()
+        physics.load_bodies(
+            ids=range(len(bodies)),
+            pos=[pos for _, _, pos in bodies],
+            velocity=np.zeros((len(bodies), 2)),
+            mass=[kind.MASS for kind, _, _ in bodies],
+            radius=[kind.RADIUS for kind, _, _ in bodies],
+        )
+        sides = np.array([side for _, side, _ in bodies])
+        goalkeepers = np.array([kind is GoalKeeper for kind, _, _ in bodies])
+        shot_boosters = np.array([getattr(kind, "SHOT_FORCE_BOOSTER", 0) for kind, _, _ in bodies])
+        return cls(physics, sides, goalkeepers, shot_boosters, ball_slot=0)
+
+    def copy(self) -> 'Simulation':
+        simulation = Simulation(self.physics.copy(), self.sides, self.goalkeepers, self.shot_boosters, self.ball_slot)
+        simulation.ticks = self.ticks
+        return simulation
+
+    def load_board(self, board: BoardUpdate):
+        for obj in board.objects:
+            slot = self.slots[obj.id]
+            self.physics.pos[slot] = (obj.pos.x, obj.pos.y)
+            self.physics.velocity[slot] = (obj.velocity.x, obj.velocity.y)
+        self.physics.velocity_changed()
+
+    def dump_board(self) -> BoardUpdate:
+        objects = []
+        for object_id, pos, velocity in zip(self.physics.ids, self.physics.pos.astype(int), self.physics.velocity):
+            objects.append(ObjectModel(
+                id=int(object_id),
+                pos=Position(x=pos[0], y=pos[1]),
+                velocity=Velocity(x=velocity[0], y=velocity[1])
+            ))
+        return BoardUpdate(mouse=MouseModel(pos=Position(x=0, y=0)), objects=objects)
+
+    def load_packed_board(self, board: PackedBoardUpdate):
+        slots = self.slot_of_id[board.objects["id"]]
+        self.physics.pos[slots, 0], self.physics.pos[slots, 1] = board.objects["x"], board.objects["y"]
+        self.physics.velocity[slots, 0] = board.objects["velocity_x"]
+        self.physics.velocity[slots, 1] = board.objects["velocity_y"]
+        self.physics.velocity_changed()
+
+    def dump_packed_board(self, mouse_pos=(0, 0), mouse_status: MouseStatus = MouseStatus.IDLE) -> PackedBoardUpdate:
+        return PackedBoardUpdate.from_arrays(
+            mouse_pos, mouse_status, self.physics.ids, self.physics.pos, self.physics.velocity
+        )
+
+    def apply_shot(self, shot: Shot):
+        self.physics.velocity[self.slots[shot.object_id]] = (shot.velocity.x, shot.velocity.y)
+        self.physics.velocity_changed()
+
+    def is_idle(self) -> bool:
+        return self.physics.is_idle()
+
+    def which_side_scored(self) -> Side | None:
+        scored_side = scored_side_values(self.physics.pos[self.ball_slot], self.physics.radius[self.ball_slot])
+        return Side(scored_side) if scored_side else None
+
+    def collision_events(self, wall_hits: np.ndarray, contacts: tuple[np.ndarray, np.ndarray]) -> list[CollisionEvent]:
+        ids = self.physics.ids
+        events = [CollisionEvent(tick=self.ticks, first_id=int(ids[slot])) for slot in wall_hits]
+        for first, second in zip(*contacts):
+            events.append(CollisionEvent(tick=self.ticks, first_id=int(ids[first]), second_id=int(ids[second])))
+        return events
+
+    def step(self, dt: float = settings.PHYSICS_TIMESTEP) -> list[CollisionEvent]:
+        wall_hits, contacts = self.physics.step(dt)
+        self.ticks += 1
+        if not len(wall_hits) and not len(contacts[0]):
+            return []
+        return self.collision_events(wall_hits, contacts)
+
+    def run_until_idle(self, dt: float = settings.PHYSICS_TIMESTEP, max_ticks: int = 100000) -> list[CollisionEvent]:
+        events = []
+        for _ in range(max_ticks):
+            if self.is_idle():
+                break
+            events += self.step(dt)
+        return events
+
+    def simulate_until_idle(self, shot: Shot | None = None, dt: float = settings.PHYSICS_TIMESTEP,
+                            max_ticks: int = 100000) -> ShotOutcome:
+        # plays the shot out at full speed, stopping early when a goal is scored like the live game does
+        if shot is not None:
+            self.apply_shot(shot)
+        start_ticks = self.ticks
+        collisions = []
+        scored_side = None
+        pos, ball_radius = self.physics.pos, float(self.physics.radius[self.ball_slot])
+        while not self.is_idle() and self.ticks - start_ticks < max_ticks:
+            collisions += self.step(dt)
+            # a plain float test first, the ball can only be in a goal once it is past a goal line
+            ball_x = float(pos[self.ball_slot, 0])
+            if ball_x + ball_radius > settings.PITCH_LEFT_BORDER and ball_x - ball_radius <= settings.PITCH_RIGHT_BORDER:
+                continue
+            scored_side = self.which_side_scored()
+            if scored_side is not None:
+                break
+        return ShotOutcome(
+            board=self.dump_board(),
+            scored_side=scored_side,
+            collisions=collisions,
+            ticks=self.ticks - start_ticks
+        )
@@ -0,0 +1,86 @@
+import numpy as np
+from collections import deque
+
+from .Protocol import PackedBoardUpdate
+import settings
+
+
+class SnapshotInterpolator:
+    # jitter buffer for the opponent's boards, they are drawn a little behind real time so there is
+    # almost always a newer board to move towards, and extrapolated from their velocities when there is not
+
+    def __init__(self, deceleration_by_id: np.ndarray | None = None,
+                 delay: float = settings.SNAPSHOT_INTERPOLATION_DELAY / 1000,
+                 extrapolation_limit: float = settings.SNAPSHOT_EXTRAPOLATION_LIMIT / 1000,
+                 max_gap: float = settings.SNAPSHOT_MAX_GAP / 1000):
+        self.deceleration_by_id = deceleration_by_id
+        self.delay = delay
+        self.extrapolation_limit = extrapolation_limit
+        self.max_gap = max_gap
+        self.snapshots: deque[tuple[float, PackedBoardUpdate]] = deque(maxlen=settings.SNAPSHOT_BUFFER_SIZE)
+        self.clock_offsets: deque[float] = deque(maxlen=settings.CLOCK_OFFSET_WINDOW)
+        self.clock_offset = 0.0
+
+    def clear(self):
+        # the clock offset stays valid, only the boards are dropped
+        self.snapshots.clear()
+
+    def push(self, board: PackedBoardUpdate, sent_time: float, arrival_time: float):
+        # the least delayed board of the window is the best guess of the sender's clock against ours
+        self.clock_offsets.append(arrival_time - sent_time)
+        self.clock_offset = min(self.clock_offsets)
+        if self.snapshots and sent_time <= self.snapshots[-1][0]:
+            self.snapshots.pop()
+        self.snapshots.append((sent_time, board))
+
+    def extrapolate(self, board: PackedBoardUpdate, duration: float) -> np.ndarray:
+        objects = board.objects
+        pos = np.stack((objects["x"], objects["y"]), axis=1).astype(np.float64)
+        velocity = np.stack((objects["velocity_x"], objects["velocity_y"]), axis=1).astype(np.float64)
+        if self.deceleration_by_id is None:
+            return pos + velocity * duration
+        # friction slows every object down at a constant rate until it stops, like the physics step does
+        speed = np.hypot(velocity[:, 0], velocity[:, 1])
+        deceleration = self.deceleration_by_id[objects["id"]]
+        stopping_time = np.divide(speed, deceleration, out=np.full_like(speed, np.inf), where=deceleration > 0)
+        moving_time = np.minimum(duration, stopping_time)
+        travel = moving_time - np.divide(
+            deceleration * moving_time ** 2, 2 * speed, out=np.zeros_like(speed), where=speed > 0
+        )
+        return pos + velocity * travel[:, None]
+
+    def sample(self, now: float) -> tuple[np.ndarray, np.ndarray] | None:
+        # object ids and their positions at now - delay, None before the first board arrived
+        if not self.snapshots:
+            return None
+        render_time = now - self.clock_offset - self.delay
+
+        # boards older than the one right before render_time are never needed again
+        while len(self.snapshots) > 1 and self.snapshots[1][0] <= render_time:
+            self.snapshots.popleft()
+        start_time, start = self.snapshots[0]
+        ids = start.objects["id"]
+
+        if render_time <= start_time:
+            return ids, self.extrapolate(start, 0)
+        if len(self.snapshots) == 1:
+            return ids, self.extrapolate(start, min(render_time - start_time, self.extrapolation_limit))
+
+        end_time, end = self.snapshots[1]
+        start_pos = self.extrapolate(start, 0)
+        if (end_time - start_time > self.max_gap or len(end.objects) != len(ids)
+                or (end.objects["id"] != ids).any()):
+            # a new turn or a reset board, it is not a move to be drawn slowly
+            return ids, start_pos
+        end_pos = self.extrapolate(end, 0)
+        alpha = (render_time - start_time) / (end_time - start_time)
+        pos = start_pos + (end_pos - start_pos) * alpha
+        # objects that jumped further than their speed allows were put somewhere, they are not slid there
+        duration = end_time - start_time
+        fastest = np.maximum(
+            np.hypot(start.objects["velocity_x"], start.objects["velocity_y"]),
+            np.hypot(end.objects["velocity_x"], end.objects["velocity_y"]),
+        )
+        jumped = np.hypot(*(end_pos - start_pos).T) > fastest * duration + settings.SNAPSHOT_TELEPORT_DISTANCE
+        pos[jumped] = start_pos[jumped]
+        return ids, pos
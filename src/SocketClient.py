@@ -1,7 +1,17 @@
+import numpy as np
 import socket
-from .Models import Match, MatchRequest, MouseModel, MouseStatus, BoardUpdate, User, load_event, dump_event
+import select
+import threading
+from collections import deque
+from typing import Callable
+from .Models import (Match, MatchRequest, MouseModel, MouseStatus, BoardUpdate, User, WireFormat, NetworkMode,
+                     Shot, DragPreview, TurnEnd, Spectate)
+from .Protocol import BoardDeltaDecoder, BoardDeltaEncoder, PackedBoardUpdate, encode_event, decode_event
 from .Player import Side
-from utils.socket import socket_ordered_recv_message, socket_ordered_send_message
+from .SendRateController import SendRateController
+import settings
+from utils.socket import SocketReceiveBuffer, socket_ordered_send_message
+from utils.time import now_time
 from pydantic import BaseModel
 import logging
 import os
@@ -21,42 +31,198 @@ class SocketClient:
         self.match: Match = None
         self.side: Side | None = None
         self.is_in_match: bool = False
+        self.wire_format: WireFormat = WireFormat.JSON
+        self.network_mode: NetworkMode = NetworkMode.STREAM
+        self.board_encoder = BoardDeltaEncoder()
+        self.board_decoder = BoardDeltaDecoder()
+        self.send_rate = SendRateController(now_time())
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        connect_started_at = now_time()
         self.socket.connect(server_addr)
+        # the tcp handshake is one round trip, the server matches players with similar ones
+        self.rtt = (now_time() - connect_started_at) * 1000
+        self.receive_buffer = SocketReceiveBuffer(self.socket)
+
+        # once the match starts the socket belongs to the network threads, the game loop only touches these
+        self.network_threads: list[threading.Thread] = []
+        self.network_error: Exception | None = None
+        self.inbound_board: deque[PackedBoardUpdate] = deque(maxlen=1) # a newer board replaces an unread one
+        self.inbound_events: deque[tuple[str, BaseModel]] = deque()
+        # every board with its send and arrival time, for the jitter buffer that draws between them
+        self.inbound_snapshots: deque[tuple[PackedBoardUpdate, float, float]] = deque(maxlen=settings.SNAPSHOT_BUFFER_SIZE)
+        self.outbound_board: deque[PackedBoardUpdate] = deque(maxlen=1) # a newer board replaces an unsent one
+        self.outbound_events: deque[BaseModel] = deque()
+        self.outbound_ready = threading.Event()
+        self.reset_board_encoder = False
+        self.on_inbound: Callable[[], None] | None = None # called from the receiving thread, so the game loop can sleep until then
+
+    def is_network_thread_running(self) -> bool:
+        return bool(self.network_threads)
+
+    def start_network_thread(self):
+        self.network_threads = [
+            threading.Thread(target=self.receive_loop, daemon=True),
+            threading.Thread(target=self.send_loop, daemon=True),
+        ]
+        for thread in self.network_threads:
+            thread.start()
+
+    def check_network_error(self):
+        if self.network_error is not None:
+            raise Exception(f"Recieving from server Error: {self.network_error=}")
+
+    def receive_board(self, board: BoardUpdate | PackedBoardUpdate, timestamp: float) -> bool:
+        # returns if the board differs from the previous one
+        arrival_time = now_time()
+        if isinstance(board, BoardUpdate):
+            board = PackedBoardUpdate.from_board_update(board)
+        # deltas are merged here, so the game loop can skip boards without losing what changed in them
+        board = self.board_decoder.decode(board)
+        is_news = self.is_board_news(board)
+        # the c++ server stamps messages itself in whole seconds, then the arrival time is all we have
+        self.inbound_snapshots.append((board, timestamp if isinstance(timestamp, float) else arrival_time, arrival_time))
+        # the board moved on without us, so our next update starts over from a keyframe
+        self.reset_board_encoder = True
+        self.replace_in_mailbox(self.inbound_board, board)
+        return is_news
+
+    def is_board_news(self, board: PackedBoardUpdate) -> bool:
+        # a heartbeat repeats the last board while nothing moves, it is no reason to wake the game loop
+        try:
+            last_board = self.inbound_snapshots[-1][0]
+        except IndexError:
+            return True
+        return (board.mouse_status != last_board.mouse_status or tuple(board.mouse_pos) != tuple(last_board.mouse_pos)
+                or not np.array_equal(board.objects, last_board.objects))
+
+    def replace_in_mailbox(self, mailbox: deque[PackedBoardUpdate], board: PackedBoardUpdate):
+        clicks = (MouseStatus.CLICK_DOWN, MouseStatus.CLICK_UP)
+        try:
+            replaced_board = mailbox[0]
+        except IndexError:
+            replaced_board = None
+        if replaced_board is not None and replaced_board.mouse_status in clicks and board.mouse_status not in clicks:
+            # a click must reach the other side even when the board it came with is skipped
+            board.mouse_status = replaced_board.mouse_status
+        mailbox.append(board)
+
+    def receive_loop(self):
+        while True:
+            try:
+                message = self.receive_buffer.recv_message()
+                # a frame we can not read ends the match like a lost connection, not just this thread
+                event = decode_event(message)
+                if event["event"] == "board_update":
+                    if not self.receive_board(event["content"], event["timestamp"]):
+                        continue
+                else:
+                    self.inbound_events.append((event["event"], event["content"]))
+            except Exception as e:
+                logging.error(f"Recieving from server Error: user({self.user})")
+                self.network_error = e
+                self.notify_inbound()
+                return
+            self.notify_inbound()
+
+    def notify_inbound(self):
+        if self.on_inbound is None:
+            return
+        try:
+            self.on_inbound()
+        except Exception:
+            # a failed wake up only costs the game loop some latency, it must not end the receiving thread
+            logging.error(f"Inbound callback Error: user({self.user})")
+
+    def send_loop(self):
+        while self.network_error is None:
+            self.outbound_ready.wait()
+            self.outbound_ready.clear()
+            try:
+                while self.outbound_events:
+                    self.send_event_now(self.outbound_events.popleft())
+                try:
+                    board = self.outbound_board.popleft()
+                except IndexError:
+                    continue
+                if self.reset_board_encoder:
+                    self.reset_board_encoder = False
+                    self.board_encoder.reset()
+                self.send_event_now(self.board_encoder.encode(board))
+            except Exception as e:
+                self.network_error = e
+                return
 
     def send_event(self, model: BaseModel):
-        message = dump_event(model)
+        if not self.is_network_thread_running():
+            self.send_event_now(model)
+            return
+        self.check_network_error()
+        if isinstance(model, DragPreview):
+            # only the latest drag matters, an unsent preview is replaced, and under backpressure it is dropped
+            try:
+                unsent = self.outbound_events.pop()
+            except IndexError:
+                unsent = None
+            if unsent is not None and not isinstance(unsent, DragPreview):
+                self.outbound_events.append(unsent)
+            if len(self.outbound_events) >= settings.OUTBOUND_EVENT_QUEUE_SIZE:
+                return
+        # shots and turn ends are never dropped, they are rare enough to always fit
+        self.outbound_events.append(model)
+        self.outbound_ready.set()
+
+    def send_event_now(self, model: BaseModel):
+        message = encode_event(model, self.wire_format)
         try:
             socket_ordered_send_message(self.socket, message)
         except:
             logging.error(f"Sending to server Error: {self.user}, message=({message})")
             raise Exception("Sending to server Error")
+        self.send_rate.message_sent()
 
 
     def get_event(self):
         try:
-            message = socket_ordered_recv_message(self.socket)
-            if message is None:
-                raise Exception
+            message = self.receive_buffer.recv_message()
         except Exception as e:
             logging.error(f"Recieving from server Error: user({self.user})")
             raise Exception(f"Recieving from server Error: {e=}")
 
-        return load_event(message)
+        return decode_event(message)
     
     def register_user(self, user: User):
+        # we keep sending json until the server confirms the requested format in match_start
+        user.wire_format = WireFormat(settings.WIRE_FORMAT)
+        user.network_mode = NetworkMode(settings.NETWORK_MODE)
         self.user = user
         self.send_event(user)
 
     def make_match_request(self):
-        match_req = MatchRequest()
+        match_req = MatchRequest(rtt=self.rtt)
         self.send_event(match_req)
 
+    def spectate(self, username: str):
+        # the server answers with the match of that player, whose boards we then get like an opponent's
+        self.send_event(Spectate(username=username))
+
     def match_approved(self, match: Match):
         self.match = match
-        self.side = (Side.RED if self.user == match.left_user else Side.BLUE)
+        if self.user.id == match.left_user.id:
+            self.side = Side.RED
+        elif self.user.id == match.right_user.id:
+            self.side = Side.BLUE
+        else:
+            self.side = None # a spectator
+        if self.side is not None:
+            # the python servers echo our user with the format they speak to us, the c++ server drops
+            # the field and so leaves us on json
+            me = match.left_user if self.side == Side.RED else match.right_user
+            self.wire_format = me.wire_format
         self.is_in_match = True
+        self.network_mode = match.network_mode()
+        self.send_rate = SendRateController(now_time())
         logging.info(f"Match Approved and started: {match=}")
+        self.start_network_thread()
 
     def pend_for_match_start(self):
         event = self.get_event()
@@ -65,14 +231,73 @@ class SocketClient:
             self.match_approved(match)
             return match
 
-    def get_board_from_opponent(self):
+    def get_board_from_opponent(self) -> BoardUpdate | PackedBoardUpdate | None:
+        if self.is_network_thread_running():
+            # never waits, None when nothing new arrived since the last frame
+            self.check_network_error()
+            try:
+                return self.inbound_board.popleft()
+            except IndexError:
+                return None
+
         event = self.get_event()
         event_name, board, timestamp = event["event"], event["content"], event["timestamp"]
         if event_name == "board_update":
-            return board
+            # the board moved on without us, so our next update starts over from a keyframe
+            self.board_encoder.reset()
+            self.receive_board(board, timestamp)
+            return self.inbound_board.popleft()
+
+    def poll_board_snapshots(self) -> list[tuple[PackedBoardUpdate, float, float]]:
+        snapshots = []
+        while self.inbound_snapshots:
+            snapshots.append(self.inbound_snapshots.popleft())
+        return snapshots
+
+    def poll_opponent_events(self) -> list[tuple[str, BaseModel]]:
+        # never blocks the game loop, returns whatever the opponent sent since the last frame
+        if self.is_network_thread_running():
+            self.check_network_error()
+            events = []
+            while self.inbound_events:
+                events.append(self.inbound_events.popleft())
+            return events
+
+        if select.select([self.socket], [], [], 0)[0]:
+            self.receive_buffer.fill()
+        events = []
+        while (message := self.receive_buffer.next_message()) is not None:
+            event = decode_event(message)
+            events.append((event["event"], event["content"]))
+        return events
 
     def exit_game(self):
+        if self.is_in_match:
+            logging.info(f"Match finished: {self.match=}, sent {self.send_rate.stats(now_time())}")
+        self.network_error = Exception("Game exited")
+        self.outbound_ready.set()
         self.socket.close()
 
-    def send_board_to_opponent(self, board_update: BoardUpdate):
-        self.send_event(board_update)
\ No newline at end of file
+    def send_board_to_opponent(self, board_update: BoardUpdate | PackedBoardUpdate):
+        if isinstance(board_update, BoardUpdate):
+            board_update = PackedBoardUpdate.from_board_update(board_update)
+        if not self.send_rate.should_send(board_update, now_time()):
+            return
+        if not self.is_network_thread_running():
+            self.send_event(self.board_encoder.encode(board_update))
+            return
+        # boards are coalesced before they are delta encoded, so a skipped board never loses a change
+        self.check_network_error()
+        if self.outbound_board:
+            self.send_rate.back_off()
+        self.replace_in_mailbox(self.outbound_board, board_update)
+        self.outbound_ready.set()
+
+    def send_shot_to_opponent(self, shot: Shot):
+        self.send_event(shot)
+
+    def send_drag_preview_to_opponent(self, drag_preview: DragPreview):
+        self.send_event(drag_preview)
+
+    def send_turn_end_to_opponent(self, turn_end: TurnEnd):
+        self.send_event(turn_end)
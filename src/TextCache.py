@@ -0,0 +1,30 @@
+import pygame
+from collections import OrderedDict
+
+
+class TextCache:
+    # rendered texts by (font, text, color), the least recently used one is dropped once it is full
+
+    def __init__(self, size: int):
+        self.size = size
+        self.surfaces: OrderedDict[tuple[pygame.font.Font, str, str], pygame.Surface] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.surfaces)
+
+    def render(self, font: pygame.font.Font, text: str, color: str) -> pygame.Surface:
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, True, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
+        return surface
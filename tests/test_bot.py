@@ -0,0 +1,22 @@
+import time
+import unittest
+
+from src.Bot import search_best_shot
+from src.Player import Side
+from src.Simulation import Simulation
+
+
+class SearchBestShotTest(unittest.TestCase):
+    TOLERANCE = 0.02 # seconds for the last tick and building the shot
+
+    def test_returns_within_budget(self):
+        simulation = Simulation.create_initial()
+        for time_budget in (0.001, 0.01, 0.05):
+            started = time.perf_counter()
+            _, shot = search_best_shot(simulation, Side.RED, time_budget, seed=0)
+            self.assertLess(time.perf_counter() - started, time_budget + self.TOLERANCE)
+            self.assertIsNotNone(shot)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,28 @@
+import select
 import socket
 import struct
 
 
-def socket_ordered_send_message(socket: socket.socket, message: str):
+def socket_sendmsg_all(socket: socket.socket, buffers: list[bytes | memoryview]):
+    # like sendall for several buffers at once, without joining them into a new bytes first
+    if not hasattr(socket, 'sendmsg'): # windows
+        socket.sendall(b''.join(buffers))
+        return
+    buffers = [memoryview(buffer).cast('B') for buffer in buffers]
+    while buffers:
+        sent = socket.sendmsg(buffers)
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers.pop(0)
+        if buffers:
+            buffers[0] = buffers[0][sent:]
+
+def socket_ordered_send_message(socket: socket.socket, message: str | bytes | memoryview):
     # prefix each message with a 4-byte 'length' . which is length of the message
-    message = message.encode('utf-8')
+    if isinstance(message, str):
+        message = message.encode('utf-8')
     message_length = struct.pack('!I', len(message))
-    socket.sendall(message_length + message)
+    socket_sendmsg_all(socket, [message_length, message])
 
 def socket_ordered_recvall(socket: socket.socket, n: int | None):
     data = b''
@@ -26,3 +42,82 @@ def socket_ordered_recv_message(socket: socket.socket):
         raise Exception("Connection Closed")
     msglen = struct.unpack('!I', raw_msglen)[0]
     return socket_ordered_recvall(socket, msglen)
+
+
+def socket_is_alive(connection: socket.socket) -> bool:
+    # a peer that hung up leaves an empty read behind, seen here before whoever reads the socket gets to it
+    try:
+        if hasattr(socket, 'MSG_DONTWAIT'):
+            data = connection.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        else:
+            # windows has no MSG_DONTWAIT, a peek with nothing to read would block, and its select is not
+            # limited to small fd numbers like the posix one
+            if not select.select([connection], [], [], 0)[0]:
+                return True
+            data = connection.recv(1, socket.MSG_PEEK)
+    except BlockingIOError:
+        return True
+    except ValueError:
+        # the readiness check could not look at the socket, that says nothing about the peer
+        return True
+    except OSError:
+        return False
+    return data != b''
+
+class SocketReceiveBuffer:
+    # reads as much as the socket has into one reusable buffer and cuts every complete message out of it,
+    # the returned memoryviews stay valid until the next read
+
+    MESSAGE_LENGTH = struct.Struct('!I')
+
+    def __init__(self, socket: socket.socket, size: int = 1 << 16):
+        self.socket = socket
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0 # first byte not handed out yet
+        self.end = 0 # end of the received bytes
+
+    def next_message(self) -> memoryview | None:
+        # a message that is already buffered, never touches the socket
+        if self.end - self.start < self.MESSAGE_LENGTH.size:
+            return None
+        message_length, = self.MESSAGE_LENGTH.unpack_from(self.view, self.start)
+        message_end = self.start + self.MESSAGE_LENGTH.size + message_length
+        if message_end > self.end:
+            return None
+        message = self.view[self.start + self.MESSAGE_LENGTH.size:message_end]
+        self.start = message_end
+        return message
+
+    def make_room(self):
+        pending = self.end - self.start
+        if pending >= self.MESSAGE_LENGTH.size:
+            needed = self.MESSAGE_LENGTH.size + self.MESSAGE_LENGTH.unpack_from(self.view, self.start)[0]
+        else:
+            needed = self.MESSAGE_LENGTH.size
+        if needed > len(self.buffer):
+            # a fresh buffer, so views handed out earlier keep pointing at their own bytes
+            buffer = bytearray(max(needed, 2 * len(self.buffer)))
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer, self.view = buffer, memoryview(buffer)
+        elif self.start:
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start, self.end = 0, pending
+
+    def fill(self):
+        if self.end == len(self.buffer) or self.start == self.end:
+            self.make_room()
+        received = self.socket.recv_into(self.view[self.end:])
+        if not received:
+            raise Exception("Connection Closed")
+        self.end += received
+
+    def recv_message(self) -> memoryview:
+        while True:
+            message = self.next_message()
+            if message is not None:
+                return message
+            if self.start:
+                self.make_room()
+            self.fill()
+